@@ -0,0 +1,4 @@
+"""Benchmarks for the hot paths of the Companion.
+
+Run them from the f1m_companion folder, ex: python -m benchmarks.compression
+"""
@@ -0,0 +1,54 @@
+"""Compare the save file compressors against the single zlib.compress baseline.
+
+Packs the databases of a synthetic save file, see benchmarks.synthetic.
+
+ex: python -m benchmarks.compression --size career --workers 1 2 4
+"""
+import argparse
+import io
+import time
+import typing as tp
+import zlib
+
+from common.xaranaktu.unpacking import pack_databases
+
+from benchmarks.synthetic import SAVE_SIZES, make_database
+
+
+def timed(func: tp.Callable[[], bytes]) -> tp.Tuple[float, bytes]:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main(size: str, level: int, workers: tp.List[int]):
+    dbs = [make_database(SAVE_SIZES[size], seed) for seed in range(3)]
+    joined = b"".join(dbs)
+    print(f"Packing 3 databases, {len(joined) / 1e6:.1f}MB, level {level}")
+
+    baseline, compressed = timed(lambda: zlib.compress(joined, level))
+    print(f"zlib.compress baseline: {baseline:.2f}s, {len(compressed) / 1e6:.1f}MB")
+
+    for nb_workers in workers:
+
+        def pack() -> bytes:
+            out = io.BytesIO()
+            pack_databases(out, dbs, level, workers=nb_workers)
+            return out.getvalue()
+
+        duration, packed = timed(pack)
+        if zlib.decompress(packed[4 + 4 * len(dbs) :]) != joined:
+            raise ValueError(f"Round-trip failed with {nb_workers} workers")
+        print(
+            f"pack_databases, {nb_workers} workers: {duration:.2f}s, "
+            f"{len(packed) / 1e6:.1f}MB, speedup x{baseline / duration:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", choices=SAVE_SIZES, default="career")
+    parser.add_argument("--level", type=int, default=zlib.Z_DEFAULT_COMPRESSION)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    main(args.size, args.level, args.workers)
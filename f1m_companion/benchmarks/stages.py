@@ -0,0 +1,368 @@
+"""Time and measure the peak memory of each stage of the save file pipeline.
+
+Runs do_unpack, do_pack, SaveFile.extract_tables, translate_db_ids,
+TranslatedDatabase and SaveFile.repack on synthetic save files, and writes the
+results to a JSON file to compare them between commits.
+
+Each stage is timed over several runs, then run once more under tracemalloc for its
+peak memory, which only counts Python and numpy allocations, not sqlite or zlib ones.
+It is also run in a fresh process for its peak RSS, all allocations included, setup of
+the stage too, whose own peak RSS is reported aside. Caches are emptied before each
+run, except the unpacked save for repack, already unpacked by the editor in the app.
+
+ex: python -m benchmarks.stages --sizes small career --output before.json
+    python -m benchmarks.stages --compare before.json after.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing as tp
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+from common import savefile, unpack_cache
+from common.constants import COMPRESS_WORKERS
+from common.database_translator import (
+    TranslatedDatabase,
+    clear_shared_lookups,
+    translate_db_ids,
+)
+from common.savefile import OriginalSaveFile
+from common.xaranaktu.unpacking import do_pack, do_unpack
+
+from benchmarks.synthetic import SAVE_SIZES, make_save_file
+
+# Setup of a stage, untimed, returns the function to time
+Stage = tp.Callable[[Path, Path, int], tp.Callable[[], tp.Any]]
+
+
+def _reset_dir(path: Path) -> Path:
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    return path
+
+
+def _read_tables(save_path: Path, work_dir: Path) -> tp.Dict[str, pd.DataFrame]:
+    _reset_dir(work_dir / "cache")
+    return OriginalSaveFile(save_path).extract_tables()
+
+
+def stage_do_unpack(save_path: Path, work_dir: Path, workers: int):
+    folder = _reset_dir(work_dir / "unpacked")
+    return lambda: do_unpack(save_path, folder)
+
+
+def stage_do_pack(save_path: Path, work_dir: Path, workers: int):
+    folder = _reset_dir(work_dir / "unpacked")
+    do_unpack(save_path, folder)
+    return lambda: do_pack(folder, work_dir / "packed.sav", workers=workers)
+
+
+def stage_extract_tables(save_path: Path, work_dir: Path, workers: int):
+    _reset_dir(work_dir / "cache")
+    return OriginalSaveFile(save_path).extract_tables
+
+
+def stage_translate_db_ids(save_path: Path, work_dir: Path, workers: int):
+    tables = _read_tables(save_path, work_dir)
+    clear_shared_lookups()
+    return lambda: translate_db_ids(tables, "Staff_PerformanceStats")
+
+
+def stage_translated_database(save_path: Path, work_dir: Path, workers: int):
+    tables = _read_tables(save_path, work_dir)
+    clear_shared_lookups()
+    return lambda: TranslatedDatabase(tables).translate_tables()
+
+
+def stage_repack(save_path: Path, work_dir: Path, workers: int):
+    tables = _read_tables(save_path, work_dir)
+    # Edit a tenth of the rows, only changed rows are written back
+    stats = tables["Staff_PerformanceStats"].copy()
+    stats.loc[stats.index[::10], "Val"] += 1
+    with unpack_cache.cached_unpack(save_path):
+        pass
+    return lambda: OriginalSaveFile(save_path).repack(
+        "repacked", {"Staff_PerformanceStats": stats}, workers=workers
+    )
+
+
+STAGES: tp.Dict[str, Stage] = {
+    "do_unpack": stage_do_unpack,
+    "do_pack": stage_do_pack,
+    "extract_tables": stage_extract_tables,
+    "translate_db_ids": stage_translate_db_ids,
+    "TranslatedDatabase": stage_translated_database,
+    "repack": stage_repack,
+}
+
+
+@contextmanager
+def redirect_folders(work_dir: Path) -> tp.Generator[None, None, None]:
+    """Redirect the unpack cache and the SaveGames folder to work_dir."""
+    with ExitStack() as stack:
+        stack.enter_context(
+            mock.patch.object(unpack_cache, "PATH_COMPANION_CACHE", work_dir / "cache")
+        )
+        stack.enter_context(mock.patch.object(savefile, "PATH_SAVES", work_dir))
+        yield
+
+
+def _peak_rss() -> int:
+    """Peak resident memory of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def measure_rss(
+    stage_name: str, save_path: Path, work_dir: Path, workers: int
+) -> tp.Dict[str, int]:
+    """Run a stage once and measure the peak RSS of the process, run in a new one.
+
+    Returns:
+        peak RSS after the setup of the stage, and after the stage, in bytes.
+    """
+    with redirect_folders(work_dir):
+        func = STAGES[stage_name](save_path, work_dir, workers)
+        gc.collect()
+        setup_rss = _peak_rss()
+        func()
+        return {"setup_rss_bytes": setup_rss, "peak_rss_bytes": _peak_rss()}
+
+
+def run_measure_rss(
+    stage_name: str, save_path: Path, work_dir: Path, workers: int
+) -> tp.Dict[str, int]:
+    """Measure the peak RSS of a stage in a new process, see measure_rss."""
+    stdout = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.stages",
+            "--measure-rss",
+            stage_name,
+            str(save_path),
+            str(work_dir),
+            "--workers",
+            str(workers),
+        ],
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return tp.cast(tp.Dict[str, int], json.loads(stdout.splitlines()[-1]))
+
+
+def run_stage(
+    stage_name: str, save_path: Path, work_dir: Path, workers: int, repeat: int
+) -> tp.Dict[str, tp.Any]:
+    """Time a stage over repeat runs, then measure its peak memory on more runs.
+
+    Returns:
+        seconds of each run, their min and median, the peak memory traced by
+        tracemalloc, and the peak RSS after setup and after the stage, in bytes.
+    """
+    stage = STAGES[stage_name]
+    seconds = []
+    for _ in range(repeat):
+        func = stage(save_path, work_dir, workers)
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+        del func
+
+    func = stage(save_path, work_dir, workers)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del func
+    return {
+        "seconds": [round(x, 4) for x in seconds],
+        "min": round(min(seconds), 4),
+        "median": round(statistics.median(seconds), 4),
+        "peak_bytes": peak,
+        **run_measure_rss(stage_name, save_path, work_dir, workers),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    sizes: tp.List[str],
+    stages: tp.List[str],
+    repeat: int = 3,
+    workers: int = COMPRESS_WORKERS,
+) -> tp.Dict[str, tp.Any]:
+    """Run the stages on a synthetic save file of each size.
+
+    The unpack cache and the SaveGames folder are redirected to a temporary folder,
+    the benchmarks never touch the saves of the Companion.
+
+    Returns:
+        results with the commit and machine they were measured on.
+    """
+    results: tp.Dict[str, tp.Any] = {
+        "commit": git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": workers,
+        "repeat": repeat,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir_str:
+        work_dir = Path(tmp_dir_str)
+        with redirect_folders(work_dir):
+            for size in sizes:
+                print(f"Generating {size} save file", flush=True)
+                save_path = make_save_file(work_dir / f"{size}.sav", size)
+                size_results: tp.Dict[str, tp.Any] = {
+                    "save_bytes": save_path.stat().st_size,
+                    "stages": {},
+                }
+                for stage_name in stages:
+                    stage_results = run_stage(
+                        stage_name, save_path, work_dir, workers, repeat
+                    )
+                    size_results["stages"][stage_name] = stage_results
+                    print(
+                        f"{size} {stage_name}: {stage_results['median']:.3f}s, "
+                        f"peak {stage_results['peak_bytes'] / 1e6:.1f}MB, "
+                        f"peak RSS {stage_results['peak_rss_bytes'] / 1e6:.1f}MB",
+                        flush=True,
+                    )
+                results["sizes"][size] = size_results
+                save_path.unlink()
+    return results
+
+
+def compare(before: tp.Dict[str, tp.Any], after: tp.Dict[str, tp.Any]) -> pd.DataFrame:
+    """Compare the median time and peak memory of the stages of two results.
+
+    Returns:
+        one row per size and stage measured in both, ratios below 1 are faster or
+        smaller after. Peak RSS is missing from results of older commits.
+    """
+    rows = []
+    for size, size_after in after["sizes"].items():
+        size_before = before["sizes"].get(size, {"stages": {}})
+        for stage_name, stage_after in size_after["stages"].items():
+            stage_before = size_before["stages"].get(stage_name)
+            if stage_before is None:
+                continue
+            rows.append(
+                {
+                    "size": size,
+                    "stage": stage_name,
+                    "seconds_before": stage_before["median"],
+                    "seconds_after": stage_after["median"],
+                    "time_ratio": round(
+                        stage_after["median"] / stage_before["median"], 2
+                    ),
+                    "peak_mb_before": round(stage_before["peak_bytes"] / 1e6, 1),
+                    "peak_mb_after": round(stage_after["peak_bytes"] / 1e6, 1),
+                    "memory_ratio": round(
+                        stage_after["peak_bytes"] / max(stage_before["peak_bytes"], 1),
+                        2,
+                    ),
+                    **{
+                        f"peak_rss_mb_{when}": round(stage["peak_rss_bytes"] / 1e6, 1)
+                        for when, stage in (
+                            ("before", stage_before),
+                            ("after", stage_after),
+                        )
+                        if "peak_rss_bytes" in stage
+                    },
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def main(sizes, stages, repeat, workers, output, compare_paths, measure_rss_args):
+    if measure_rss_args:
+        stage_name, save_path, work_dir = measure_rss_args
+        print(
+            json.dumps(
+                measure_rss(stage_name, Path(save_path), Path(work_dir), workers)
+            )
+        )
+        return
+
+    if compare_paths:
+        before, after = (json.loads(Path(x).read_text()) for x in compare_paths)
+        print(f"{before['commit']} -> {after['commit']}")
+        print(compare(before, after).to_string(index=False))
+        return
+
+    results = run_benchmarks(sizes, stages, repeat, workers)
+    if output is None:
+        output = f"benchmark_{results['commit'] or 'nocommit'}.json"
+    Path(output).write_text(json.dumps(results, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--sizes", nargs="+", choices=SAVE_SIZES, default=["small", "career"]
+    )
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=COMPRESS_WORKERS)
+    parser.add_argument(
+        "--output", help="JSON file of the results, defaults to benchmark_<commit>."
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BEFORE", "AFTER"),
+        help="Compare two JSON files of results instead of running benchmarks.",
+    )
+    parser.add_argument(
+        "--measure-rss",
+        nargs=3,
+        metavar=("STAGE", "SAVE", "WORK_DIR"),
+        help=argparse.SUPPRESS,
+    )
+    args = parser.parse_args()
+    main(
+        args.sizes,
+        args.stages,
+        args.repeat,
+        args.workers,
+        args.output,
+        args.compare,
+        args.measure_rss,
+    )
@@ -0,0 +1,220 @@
+"""Generate synthetic save files, in the format of the game, to benchmark on.
+
+The databases hold the tables read by the Companion (Player, Teams, Staff_*, ...)
+with random rows, and a Races_Results table sized to reach the size of real saves.
+
+ex: python -m benchmarks.synthetic /tmp/career.sav --size career
+"""
+import argparse
+import random
+import sqlite3
+import typing as tp
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+
+from common.xaranaktu.unpacking import CHUNK_SIZE, DB_HEADER, DB_NAMES, NONE_NONE_SIG
+
+NB_TEAMS = 10
+NB_RACES = 23
+NB_STATS = 12
+
+
+@dataclass(frozen=True)
+class SaveSize:
+    """Rows of the largest tables of a synthetic save.
+
+    Args:
+        staff: rows of Staff_BasicData, a fifth of them are drivers
+        results: rows of Races_Results
+    """
+
+    staff: int
+    results: int
+
+
+SAVE_SIZES = {
+    # Fresh career, a few MB per database
+    "small": SaveSize(staff=2_000, results=20_000),
+    # Career after a few seasons, about 35MB per database
+    "career": SaveSize(staff=20_000, results=800_000),
+    # Far beyond real saves, about 200MB per database
+    "stress": SaveSize(staff=100_000, results=5_000_000),
+}
+
+SCHEMA = """
+CREATE TABLE Player (FirstName TEXT, LastName TEXT, TeamID INTEGER,
+    UniqueSeed INTEGER);
+CREATE TABLE Player_State (Day INTEGER, CurrentSeason INTEGER);
+CREATE TABLE Teams (TeamID INTEGER PRIMARY KEY, TeamName TEXT, Budget INTEGER);
+CREATE TABLE Races_Tracks (TrackID INTEGER PRIMARY KEY, Name TEXT);
+CREATE TABLE Races (RaceID INTEGER PRIMARY KEY, TrackID INTEGER, Day INTEGER);
+CREATE TABLE Save_Weekend (RaceID INTEGER, WeekendStage INTEGER);
+CREATE TABLE Board_Enum_ObjectiveStates (Value INTEGER PRIMARY KEY, Name TEXT);
+CREATE TABLE Board_Enum_ObjectiveTypes (Value INTEGER PRIMARY KEY, Name TEXT);
+CREATE TABLE Board_Objectives (TeamID INTEGER, ObjectiveID INTEGER, State INTEGER,
+    Type INTEGER, PRIMARY KEY (TeamID, ObjectiveID));
+CREATE TABLE Staff_BasicData (StaffID INTEGER PRIMARY KEY, FirstName TEXT,
+    LastName TEXT, Nationality TEXT, DOB REAL);
+CREATE TABLE Staff_DriverData (StaffID INTEGER PRIMARY KEY, Improvability INTEGER,
+    Aggression INTEGER, HasSuperLicense INTEGER, Marketability REAL);
+CREATE TABLE Staff_Enum_PerformanceStatTypes (Value INTEGER PRIMARY KEY, Name TEXT);
+CREATE TABLE Staff_PerformanceStats (StaffID INTEGER, StatID INTEGER, Val REAL,
+    Max REAL, PRIMARY KEY (StaffID, StatID));
+CREATE TABLE Races_Results (Season INTEGER, RaceID INTEGER, DriverID INTEGER,
+    TeamID INTEGER, FinishingPos INTEGER, Points REAL, FastestLap REAL);
+"""
+NATIONALITIES = ["France", "Italy", "Germany", "Brazil", "Japan", "Spain", "UK"]
+
+
+def make_database(size: SaveSize, seed: int = 0) -> bytes:
+    """Build the sqlite database of a synthetic save.
+
+    Returns:
+        content of the database, ex: from serialize().
+    """
+    rng = random.Random(seed)
+    sql_conn = sqlite3.connect(":memory:")
+    sql_conn.executescript(SCHEMA)
+    team_id = rng.randrange(1, NB_TEAMS + 1)
+    sql_conn.execute(
+        "INSERT INTO Player VALUES ('[TEAMPRINCIPAL_TEAM]', '[TEAMPRINCIPAL_TEAM]', "
+        f"{team_id}, {rng.randrange(100_000)})"
+    )
+    sql_conn.execute("INSERT INTO Player_State VALUES (45000, 2023)")
+    sql_conn.executemany(
+        "INSERT INTO Teams VALUES (?, ?, ?)",
+        ((i, f"Team {i}", rng.randrange(10**8)) for i in range(1, NB_TEAMS + 1)),
+    )
+    sql_conn.executemany(
+        "INSERT INTO Races_Tracks VALUES (?, ?)",
+        ((i, f"Track {i}") for i in range(1, NB_RACES + 1)),
+    )
+    sql_conn.executemany(
+        "INSERT INTO Races VALUES (?, ?, ?)",
+        ((i, i, 45000 + 14 * i) for i in range(1, NB_RACES + 1)),
+    )
+    sql_conn.execute("INSERT INTO Save_Weekend VALUES (1, 9)")
+    for table_name in ("Board_Enum_ObjectiveStates", "Board_Enum_ObjectiveTypes"):
+        sql_conn.executemany(
+            f"INSERT INTO {table_name} VALUES (?, ?)",
+            ((i, f"[{table_name}_{i}]") for i in range(5)),
+        )
+    sql_conn.executemany(
+        "INSERT INTO Board_Objectives VALUES (?, ?, ?, ?)",
+        (
+            (team, objective, rng.randrange(5), rng.randrange(5))
+            for team in range(1, NB_TEAMS + 1)
+            for objective in range(10)
+        ),
+    )
+
+    sql_conn.executemany(
+        "INSERT INTO Staff_BasicData VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                i,
+                f"[STAFF_NAME_FirstName_{rng.randrange(300)}]",
+                f"[STAFF_NAME_LastName_{rng.randrange(5000)}]",
+                rng.choice(NATIONALITIES),
+                rng.uniform(25000, 40000),
+            )
+            for i in range(size.staff)
+        ),
+    )
+    drivers = range(0, size.staff, 5)
+    sql_conn.executemany(
+        "INSERT INTO Staff_DriverData VALUES (?, ?, ?, ?, ?)",
+        (
+            (i, rng.randrange(10), rng.randrange(100), rng.randrange(2), rng.random())
+            for i in drivers
+        ),
+    )
+    sql_conn.executemany(
+        "INSERT INTO Staff_Enum_PerformanceStatTypes VALUES (?, ?)",
+        ((i, f"[STAFF_STAT_{i}]") for i in range(NB_STATS)),
+    )
+    sql_conn.executemany(
+        "INSERT INTO Staff_PerformanceStats VALUES (?, ?, ?, ?)",
+        (
+            (i, stat, rng.uniform(0, 100), 100.0)
+            for i in range(size.staff)
+            for stat in range(NB_STATS)
+        ),
+    )
+    sql_conn.executemany(
+        "INSERT INTO Races_Results VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (
+                2023 + i // (NB_RACES * 20),
+                i // 20 % NB_RACES + 1,
+                rng.choice(drivers),
+                rng.randrange(1, NB_TEAMS + 1),
+                i % 20 + 1,
+                float(max(0, 25 - i % 20 * 2)),
+                rng.uniform(60, 120),
+            )
+            for i in range(size.results)
+        ),
+    )
+    sql_conn.commit()
+    database = sql_conn.serialize()
+    sql_conn.close()
+    return database
+
+
+def make_chunk1(seed: int = 0, size: int = 4096) -> bytes:
+    """Build a chunk1, random bytes ending with the signature of the DB section."""
+    rng = random.Random(seed)
+    header = b"GVAS" + rng.randbytes(size)
+    # Unknown 4 bytes between the signature and the DB section header
+    return header.replace(NONE_NONE_SIG, b"") + NONE_NONE_SIG + bytes(4)
+
+
+def write_save_file(
+    path: Path,
+    chunk1: bytes,
+    dbs: tp.Sequence[bytes],
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+):
+    """Write a save file: chunk1, the DB section header, then the zlib stream."""
+    sizes = [len(x) for x in dbs] + [0] * (len(DB_NAMES) - len(dbs))
+    compressor = zlib.compressobj(level)
+    with open(path, "wb") as f:
+        f.write(chunk1)
+        header_off = f.tell()
+        f.write(DB_HEADER.pack(0, *sizes))
+        data_off = f.tell()
+        for db in dbs:
+            view = memoryview(db)
+            for i in range(0, len(view), CHUNK_SIZE):
+                f.write(compressor.compress(view[i : i + CHUNK_SIZE]))
+        f.write(compressor.flush())
+        data_end = f.tell()
+        f.seek(header_off)
+        f.write(DB_HEADER.pack(data_end - data_off, *sizes))
+
+
+def make_save_file(path: Path, size: str, seed: int = 0) -> Path:
+    """Write a synthetic save file, its backups are copies of main.db.
+
+    Args:
+        path: save file to write
+        size: key of SAVE_SIZES
+        seed: seed of the random rows
+
+    Returns:
+        path of the save file.
+    """
+    main_db = make_database(SAVE_SIZES[size], seed)
+    write_save_file(path, make_chunk1(seed), [main_db] * len(DB_NAMES))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", type=Path)
+    parser.add_argument("--size", choices=SAVE_SIZES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_save_file(args.path, args.size, args.seed)
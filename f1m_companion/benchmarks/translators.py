@@ -0,0 +1,57 @@
+"""Compare row-wise and vectorized translator functions on a staff table.
+
+ex: python -m benchmarks.translators --rows 5000
+"""
+import argparse
+import random
+import time
+
+import pandas as pd
+from common.column_translators import extract_full_name, extract_full_names
+
+
+def make_staff_table(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build a Staff_BasicData-like table with localisation keys as names."""
+    rng = random.Random(seed)
+    return pd.DataFrame(
+        {
+            "StaffID": range(rows),
+            "FirstName": [
+                f"[STAFF_NAME_FirstName_{rng.randrange(300)}]" for _ in range(rows)
+            ],
+            "LastName": [
+                f"[STAFF_NAME_LastName_{rng.randrange(5000)}]" for _ in range(rows)
+            ],
+        }
+    )
+
+
+def main(rows: int, repeat: int):
+    df = make_staff_table(rows)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        row_wise = df.apply(extract_full_name, axis=1)
+    row_wise_duration = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        vectorized = extract_full_names(df)
+    vectorized_duration = (time.perf_counter() - start) / repeat
+
+    if not row_wise.equals(vectorized):
+        raise ValueError("Row-wise and vectorized translations differ")
+    print(f"Translating {rows} staff names, average of {repeat} runs")
+    print(f"row-wise apply: {row_wise_duration * 1000:.1f}ms")
+    print(
+        f"vectorized: {vectorized_duration * 1000:.1f}ms, "
+        f"speedup x{row_wise_duration / vectorized_duration:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
@@ -0,0 +1,55 @@
+"""Pick up the save files written by the game in the SaveGames folder.
+
+New or changed save files reported by the folder watcher are indexed in the catalog
+right away, and when enabled, imported under their rich name by a background job.
+"""
+from pathlib import Path
+
+from common import catalog, jobs
+from common.constants import AUTO_IMPORT_SAVES, PATH_COMPANION_SAVES
+from common.save_store import MANIFEST_SUFFIX, store_save_file
+from common.savefile import OriginalSaveFile, format_rich_name
+from common.watcher import save_games_watcher
+from common.xaranaktu.unpacking import ProgressCallback
+
+# Shared by all sessions, like the SaveGames folder
+_enabled = AUTO_IMPORT_SAVES
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+
+def import_save_file(save_path: Path, progress: ProgressCallback | None = None) -> Path:
+    """Import a save file under its rich name, overwriting a save of the same name.
+
+    Returns:
+        path of the manifest of the imported save.
+    """
+    rich_fields = catalog.index_save_file(OriginalSaveFile(save_path))
+    if not rich_fields:
+        raise ValueError(f"Could not read {save_path.name}, see the catalog error")
+    manifest_path = (PATH_COMPANION_SAVES / format_rich_name(rich_fields)).with_suffix(
+        MANIFEST_SUFFIX
+    )
+    return store_save_file(save_path, manifest_path, progress)
+
+
+def _on_save_changed(save_path: Path):
+    save_file = OriginalSaveFile(save_path)
+    if _enabled:
+        jobs.submit(
+            "import", f"Auto import {save_file.name}", import_save_file, save_path
+        )
+    else:
+        catalog.refresh([save_file])
+
+
+def start():
+    """Follow the SaveGames folder, can be called on every page run."""
+    save_games_watcher().subscribe(_on_save_changed)
@@ -0,0 +1,190 @@
+"""Apply a table set to many save files in parallel, without the UI.
+
+Run from f1m_companion, ex:
+    python -m common.batch --table-set my_custom_tables "/path/to/saves/*.sav" \\
+        --output-dir /path/to/edited
+"""
+import argparse
+import glob
+import time
+import typing as tp
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+
+from common.constants import PATH_SAVES, REPACK_WORKERS
+from common.savefile import OriginalSaveFile
+from common.table_sets import list_tables, read_table
+
+
+def expand_saves(patterns: tp.Iterable[str]) -> tp.List[Path]:
+    """Save files matching paths or glob patterns, without duplicates."""
+    paths: tp.Dict[Path, None] = {}
+    for pattern in patterns:
+        for match in sorted(glob.glob(pattern)) or [pattern]:
+            paths[Path(match).resolve()] = None
+    return list(paths)
+
+
+def output_paths(
+    save_paths: tp.List[Path], output_dir: Path, suffix: str
+) -> tp.List[Path]:
+    """Repacked save file of each save file, numbered when their names collide.
+
+    ex: autosave1.sav of two careers -> autosave1_edited.sav, autosave1_edited_2.sav
+
+    Returns:
+        output path of each save, in the order of save_paths.
+    """
+    paths: tp.List[Path] = []
+    # Case insensitive, like the filesystem of the game
+    taken: tp.Set[str] = set()
+    for save_path in save_paths:
+        stem = save_path.stem + suffix
+        candidate, i = stem, 1
+        while candidate.lower() in taken:
+            i += 1
+            candidate = f"{stem}_{i}"
+        taken.add(candidate.lower())
+        paths.append(output_dir / f"{candidate}.sav")
+    return paths
+
+
+def apply_table_set(
+    save_path: Path,
+    output_path: Path,
+    table_set: str,
+    table_names: tp.List[str],
+    level: int,
+) -> tp.Dict[str, tp.Any]:
+    """Repack a save file with tables of a table set, in a worker process.
+
+    Returns:
+        summary of the save: save, output, seconds and error if any.
+    """
+    start = time.perf_counter()
+    summary: tp.Dict[str, tp.Any] = {"save": str(save_path), "output": None}
+    try:
+        table_paths = list_tables(table_set)
+        tables = {x: read_table(table_paths[x]) for x in table_names}
+        save_file = OriginalSaveFile(save_path)
+        summary["output"] = str(
+            save_file.repack_to(output_path, tables, level, replace=True)
+        )
+        summary["error"] = None
+    except Exception as e:
+        summary["error"] = repr(e)
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def apply_table_set_to_saves(
+    save_paths: tp.List[Path],
+    table_set: str,
+    table_names: tp.List[str] | None = None,
+    suffix: str = "_edited",
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+    workers: int = REPACK_WORKERS,
+    output_dir: Path | None = None,
+) -> pd.DataFrame:
+    """Repack each save file with tables of a table set, one save per process.
+
+    Args:
+        save_paths: save files to edit
+        table_set: folder of tables in PATH_COMPANION_TABLES
+        table_names: tables to apply. Defaults to None, all tables of the set.
+        suffix: appended to the name of the repacked save files, numbered when
+            save files of the same name are repacked, see output_paths
+        level: zlib compression level, 1 is fastest, 9 is smallest
+        workers: number of save files processed at once
+        output_dir: folder of the repacked save files. Defaults to None, PATH_SAVES.
+
+    Returns:
+        summary of each save, in the order of save_paths.
+    """
+    if table_names is None:
+        table_names = list(list_tables(table_set))
+    if output_dir is None:
+        output_dir = PATH_SAVES
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                apply_table_set, path, output_path, table_set, table_names, level
+            )
+            for path, output_path in zip(
+                save_paths, output_paths(save_paths, output_dir, suffix)
+            )
+        ]
+        for future in as_completed(futures):
+            summary = future.result()
+            status = "failed" if summary["error"] else "done"
+            print(f"{status} {summary['save']} in {summary['seconds']}s", flush=True)
+    return pd.DataFrame([x.result() for x in futures])
+
+
+def main(saves, table_set, tables, suffix, level, workers, output_dir):
+    save_paths = expand_saves(saves)
+    summary = apply_table_set_to_saves(
+        save_paths, table_set, tables, suffix, level, workers, output_dir
+    )
+    print(summary.to_string(index=False))
+    return int(summary["error"].notna().any())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply a table set to F1 Manager Save Files."
+    )
+    parser.add_argument(
+        "saves",
+        help="Save files to edit, paths or glob patterns.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--table-set",
+        help="Name of the folder of tables in the companion tables folder.",
+        required=True,
+    )
+    parser.add_argument(
+        "--tables",
+        help="Tables to apply. Defaults to all tables of the table set.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--suffix",
+        help="Appended to the names of the repacked save files.",
+        default="_edited",
+    )
+    parser.add_argument(
+        "--level",
+        help="zlib compression level, 1 is fastest, 9 is smallest.",
+        type=int,
+        choices=range(-1, 10),
+        default=zlib.Z_DEFAULT_COMPRESSION,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of save files processed at once.",
+        type=int,
+        default=REPACK_WORKERS,
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="Folder of the repacked save files. Defaults to the SaveGames folder.",
+        type=Path,
+    )
+    args = parser.parse_args()
+    raise SystemExit(
+        main(
+            args.saves,
+            args.table_set,
+            args.tables,
+            args.suffix,
+            args.level,
+            args.workers,
+            args.output_dir,
+        )
+    )
@@ -0,0 +1,131 @@
+"""Catalog of the save files rich fields, filled in the background.
+
+Extracting the rich fields of a save file needs to unpack it, so they are stored in a
+SQLite sidecar keyed by path, size and mtime. Only new or changed save files are
+processed again, by a small thread pool shared by all sessions.
+"""
+import sqlite3
+import threading
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from common.constants import CATALOG_WORKERS, FILE_COMPANION_CATALOG
+from common.savefile import SaveFile, format_rich_name, read_rich_fields
+
+RICH_FIELDS = ["save_type", "team", "day", "track", "session", "seed"]
+
+_executor = ThreadPoolExecutor(
+    max_workers=CATALOG_WORKERS, thread_name_prefix="catalog"
+)
+_pending: tp.Set[str] = set()
+_pending_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    FILE_COMPANION_CATALOG.parent.mkdir(parents=True, exist_ok=True)
+    sql_conn = sqlite3.connect(FILE_COMPANION_CATALOG, timeout=30)
+    fields = ", ".join(f"{x} TEXT" for x in RICH_FIELDS)
+    sql_conn.execute(
+        "CREATE TABLE IF NOT EXISTS saves (path TEXT PRIMARY KEY, size INTEGER, "
+        f"mtime_ns INTEGER, {fields}, rich_name TEXT, error TEXT)"
+    )
+    return sql_conn
+
+
+def index_save_file(save_file: SaveFile) -> tp.Dict[str, str]:
+    """Extract the rich fields of a save file and store them in the catalog.
+
+    Returns:
+        rich fields of the save file.
+    """
+    stat = save_file.path.stat()
+    values: tp.List[str | None]
+    try:
+        with save_file.unpack_in_memory() as (_, sql_conn):
+            rich_fields = read_rich_fields(sql_conn)
+        values = [rich_fields[x] for x in RICH_FIELDS]
+        rich_name, error = format_rich_name(rich_fields), None
+    except Exception as e:
+        rich_fields = {}
+        values = [None] * len(RICH_FIELDS)
+        rich_name, error = None, repr(e)
+
+    with _connect() as sql_conn:
+        sql_conn.execute(
+            f"INSERT OR REPLACE INTO saves VALUES ({', '.join('?' * 11)})",
+            [str(save_file.path), stat.st_size, stat.st_mtime_ns, *values]
+            + [rich_name, error],
+        )
+    sql_conn.close()
+    return rich_fields
+
+
+def _index_in_background(save_file: SaveFile):
+    try:
+        index_save_file(save_file)
+    finally:
+        with _pending_lock:
+            _pending.discard(str(save_file.path))
+
+
+def refresh(save_files: tp.Iterable[SaveFile]) -> int:
+    """Index new or changed save files in the background.
+
+    Args:
+        save_files: save files that should be in the catalog
+
+    Returns:
+        number of save files waiting to be indexed.
+    """
+    sql_conn = _connect()
+    known = {
+        path: (size, mtime_ns)
+        for path, size, mtime_ns in sql_conn.execute(
+            "SELECT path, size, mtime_ns FROM saves"
+        )
+    }
+    sql_conn.close()
+
+    with _pending_lock:
+        for save_file in save_files:
+            path = str(save_file.path)
+            stat = save_file.path.stat()
+            if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            if path not in _pending:
+                _pending.add(path)
+                _executor.submit(_index_in_background, save_file)
+        return len(_pending)
+
+
+def nb_pending() -> int:
+    """Number of save files waiting to be indexed."""
+    with _pending_lock:
+        return len(_pending)
+
+
+def load(save_files: tp.Iterable[SaveFile]) -> pd.DataFrame:
+    """Query the catalog for the given save files, without unpacking them.
+
+    Save files not indexed yet, or changed since, have empty rich fields.
+
+    Returns:
+        one row per save file indexed on its name, with its rich fields.
+    """
+    save_files = list(save_files)
+    sql_conn = _connect()
+    catalog = pd.read_sql_query("SELECT * FROM saves", sql_conn)
+    sql_conn.close()
+
+    df = pd.DataFrame(
+        {
+            "name": [x.name for x in save_files],
+            "path": [str(x.path) for x in save_files],
+            "size": [x.path.stat().st_size for x in save_files],
+            "mtime_ns": [x.path.stat().st_mtime_ns for x in save_files],
+        }
+    )
+    df = df.merge(catalog, on=["path", "size", "mtime_ns"], how="left")
+    return df.set_index("name")[RICH_FIELDS + ["rich_name", "error"]]
@@ -7,15 +7,24 @@ from dataclasses import dataclass
 
 import pandas as pd
 
+RowFunc = tp.Callable[[pd.Series], tp.Any]
+TableFunc = tp.Callable[[pd.DataFrame], pd.Series]
+
 
 def extract_full_name(row: pd.Series) -> tp.Any:
-    """Extract 'Charles' and 'Leclerc' from name columns."""
+    """Extract 'Charles' and 'Leclerc' from name columns, row by row."""
     first_name: str = row["FirstName"]
     first_name = first_name.strip("[|]").split("_")[-1]
     last_name: str = row["LastName"]
     last_name = last_name.strip("[|]").split("_")[-1]
-    row["FullName"] = first_name + " " + last_name
-    return row["FullName"]
+    return first_name + " " + last_name
+
+
+def extract_full_names(df: pd.DataFrame) -> pd.Series:
+    """Extract 'Charles' and 'Leclerc' from name columns, for the whole table."""
+    first_names = df["FirstName"].str.strip("[|]").str.rsplit("_", n=1).str[-1]
+    last_names = df["LastName"].str.strip("[|]").str.rsplit("_", n=1).str[-1]
+    return first_names + " " + last_names
 
 
 @dataclass(frozen=True)
@@ -27,7 +36,9 @@ class ColumnTranslator:
         foreign_table_name: Name of table to generate translation from
         foreign_id_col: Name of column to join on
         foreign_value_col: name of generated translation column
-        func: function to generate translation
+        func: function to generate translation, from a row of the foreign table
+        vectorized: func takes the whole foreign table and returns a Series
+            instead, much faster than row by row
     """
 
     table_prefix: str
@@ -35,7 +46,8 @@ class ColumnTranslator:
     foreign_table_name: str
     foreign_id_col: str
     foreign_value_col: str
-    func: tp.Callable[[pd.Series], tp.Any] | None
+    func: RowFunc | TableFunc | None
+    vectorized: bool = False
 
     @property
     def tmp_col(self) -> str:
@@ -60,7 +72,13 @@ CONFIG_COLUMN_TRANSLATORS = [
     ColumnTranslator("Building", "Type", "Building_Enum_Types", "Type", "Name", None),
     ColumnTranslator("Building", "", "Building_Furbishment", "Value", "Name", None),
     ColumnTranslator(
-        "Staff", "StaffID", "Staff_BasicData", "StaffID", "FullName", extract_full_name
+        "Staff",
+        "StaffID",
+        "Staff_BasicData",
+        "StaffID",
+        "FullName",
+        extract_full_names,
+        vectorized=True,
     ),
     ColumnTranslator(
         "Staff", "StatID", "Staff_Enum_PerformanceStatTypes", "Value", "Name", None
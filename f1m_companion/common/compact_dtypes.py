@@ -0,0 +1,69 @@
+"""Smaller in-memory dtypes for the tables read from save files.
+
+Tables read from sqlite only have int64, float64 and object columns. Integer columns
+are downcast to the smallest integer dtype holding their values, and text columns with
+few distinct values become categories. Floats are left untouched, downcasting them
+would lose precision. Both conversions are reversed exactly by expand_dtypes.
+"""
+import typing as tp
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+# Text columns with at most this ratio of distinct values become categories
+CATEGORY_MAX_RATIO = 0.5
+
+
+def compact_dtypes(
+    df: pd.DataFrame, affinities: tp.Dict[str, str] | None = None
+) -> pd.DataFrame:
+    """Downcast integer columns and categorize low cardinality text columns.
+
+    Args:
+        df: table as read from sqlite
+        affinities: sqlite affinity of the columns, only INTEGER and TEXT columns are
+            compacted. Defaults to None, guessed from the dtypes.
+
+    Returns:
+        compacted copy of df, sharing the columns left untouched.
+    """
+    df = df.copy(deep=False)
+    for col in df.columns:
+        affinity = (affinities or {}).get(col)
+        values = df[col]
+        if is_integer_dtype(values) and affinity in (None, "INTEGER"):
+            df[col] = pd.to_numeric(values, downcast="integer")
+        elif (
+            values.dtype == object
+            and affinity in (None, "TEXT")
+            and len(values)
+            and values.map(type).eq(str).all()
+            and values.nunique() <= CATEGORY_MAX_RATIO * len(values)
+        ):
+            df[col] = values.astype("category")
+    return df
+
+
+def expand_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Reverse compact_dtypes, back to int64 and object columns.
+
+    Returns:
+        df itself if it has no compacted columns, else an expanded copy.
+    """
+    expanded: tp.Dict[str, pd.Series] = {}
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            expanded[col] = df[col].astype(object)
+        elif isinstance(df[col].dtype, np.dtype) and df[col].dtype.kind in "iu":
+            if df[col].dtype == np.int64:
+                continue
+            expanded[col] = df[col].astype("int64")
+    if not expanded:
+        return df
+    return df.assign(**expanded)
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Bytes used by df, including the content of object columns."""
+    return int(df.memory_usage(deep=True).sum())
@@ -4,15 +4,42 @@ import typing as tp
 
 import streamlit as st
 
+from common import catalog, jobs
+from common.watcher import save_games_watcher
+
 Generic = tp.TypeVar("Generic")
 
 
+@tp.overload
 def selectbox_with_default(
     label: str,
     values: tp.Iterable[Generic],
     default: Generic | None = None,
     default_display: str = "<select>",
+    stop: tp.Literal[True] = True,
 ) -> Generic:
+    ...
+
+
+@tp.overload
+def selectbox_with_default(
+    label: str,
+    values: tp.Iterable[Generic],
+    default: Generic | None = None,
+    default_display: str = "<select>",
+    *,
+    stop: bool,
+) -> Generic | None:
+    ...
+
+
+def selectbox_with_default(
+    label: str,
+    values: tp.Iterable[Generic],
+    default: Generic | None = None,
+    default_display: str = "<select>",
+    stop: bool = True,
+) -> Generic | None:
     """Add session state management and default value to selectbox.
 
     Args:
@@ -20,9 +47,11 @@ def selectbox_with_default(
         values: selectbox options
         default: pre-selected option. Defaults to None.
         default_display: pre-selected option display. Defaults to "<select>".
+        stop: stop the page while nothing is selected, else return None.
+            Defaults to True.
 
     Returns:
-        selectbox selection.
+        selectbox selection, None if nothing is selected and stop is False.
     """
     # When changing pages, keys used by components in the first page are cleanup up
     # If you want to keep the state somewhere, you have to store it separately
@@ -41,6 +70,55 @@ def selectbox_with_default(
         key=key,
     )
     st.session_state[key_save] = selected
-    if selected is None:
+    if selected is None and stop:
         st.stop()
     return selected
+
+
+def jobs_status(kind: str, limit: int = 5):
+    """Show progress of the latest background jobs of a kind.
+
+    Args:
+        kind: type of jobs to show, ex: repack
+        limit: number of jobs shown
+    """
+    df_jobs = jobs.load()
+    df_jobs = df_jobs[df_jobs["kind"] == kind].head(limit)
+    if df_jobs.empty:
+        return
+    st.subheader("Background jobs")
+    for _, job in df_jobs.iterrows():
+        if job["status"] in (jobs.STATUS_QUEUED, jobs.STATUS_RUNNING):
+            total = job["total_bytes"]
+            fraction = job["done_bytes"] / total if total else 0.0
+            st.progress(
+                min(fraction, 1.0), text=f"{job['description']} ({job['status']})"
+            )
+        elif job["status"] == jobs.STATUS_DONE:
+            st.success(f"{job['description']}: {job['result']}")
+        else:
+            st.error(f"{job['description']}: {job['status']} {job['error']}")
+    st.button("Refresh jobs", key=f"refresh_jobs_{kind}")
+
+
+def rerun_on_new_saves(version: int, nb_pending: int, interval: float = 1.0):
+    """Keep the page running, and run it again when the SaveGames folder changes.
+
+    Must be called last, Streamlit stops the page on the next element update when
+    users interact with it.
+
+    Args:
+        version: version of the save games watcher the page was run with
+        nb_pending: save files waiting to be indexed in the catalog, the page also
+            runs again when some are indexed
+        interval: seconds between checks
+    """
+    ticker = st.empty()
+    watcher = save_games_watcher()
+    while watcher.wait(version, interval) == version:
+        if catalog.nb_pending() < nb_pending:
+            break
+        ticker.empty()
+    # st.rerun replaces st.experimental_rerun from streamlit 1.27
+    rerun = getattr(st, "rerun", None) or getattr(st, "experimental_rerun")
+    rerun()
@@ -1,9 +1,57 @@
 """Constants for the whole project."""
 
+import os
 from pathlib import Path
 
 PATH_SAVES = Path("/usr/home/project/saves")
 PATH_COMPANION = PATH_SAVES / "companion"
 PATH_COMPANION_SAVES = PATH_COMPANION / "saves"
 PATH_COMPANION_TABLES = PATH_COMPANION / "tables"
+PATH_COMPANION_CACHE = PATH_COMPANION / "cache"
+PATH_COMPANION_BLOBS = PATH_COMPANION / "blobs"
+PATH_COMPANION_BUILDS = PATH_COMPANION / "builds"
+PATH_COMPANION_TIMESERIES = PATH_COMPANION / "timeseries"
 FAKE_PATH_F1M = Path("F1Manager23", "Save", "SaveGames")
+FILE_COMPANION_CATALOG = PATH_COMPANION / "catalog.db"
+FILE_COMPANION_JOBS = PATH_COMPANION / "jobs.db"
+
+# Save files processed at once by the batch tools
+REPACK_WORKERS = os.cpu_count() or 1
+
+# Save files read at once by the catalog, each holds about twice its main.db in memory
+CATALOG_WORKERS = int(os.environ.get("F1M_CATALOG_WORKERS", 2))
+
+# Threads compressing a save file when repacking. 1 writes a single zlib stream,
+# byte-identical to zlib.compress, more deflate blocks in parallel, pigz style
+COMPRESS_WORKERS = int(os.environ.get("F1M_COMPRESS_WORKERS", 1))
+
+# Background jobs (imports, repacks) running at once, others wait in queue
+JOB_WORKERS = int(os.environ.get("F1M_JOB_WORKERS", 2))
+
+# Disk space the unpacked saves cache may use before evicting least recently used
+UNPACK_CACHE_MAX_BYTES = int(
+    os.environ.get("F1M_UNPACK_CACHE_MAX_BYTES", 4 * 1024 * 1024 * 1024)
+)
+
+# Companion saves rebuilt from their manifest kept on disk, least recently used ones
+# are deleted first
+COMPANION_BUILDS_MAX = int(os.environ.get("F1M_COMPANION_BUILDS_MAX", 8))
+
+# Seconds without writes before a save file of the SaveGames folder is picked up
+WATCH_DEBOUNCE_SECONDS = float(os.environ.get("F1M_WATCH_DEBOUNCE_SECONDS", 2))
+# Poll the SaveGames folder instead of using inotify, ex: on network or Docker mounts
+WATCH_POLLING = os.environ.get("F1M_WATCH_POLLING", "0") == "1"
+# Import new save files of the SaveGames folder as soon as the game writes them
+AUTO_IMPORT_SAVES = os.environ.get("F1M_AUTO_IMPORT_SAVES", "0") == "1"
+
+# Unpack saves straight to sqlite in memory instead of the disk cache, trades memory
+# for disk I/O on slow filesystems
+UNPACK_IN_MEMORY = os.environ.get("F1M_UNPACK_IN_MEMORY", "0") == "1"
+
+# Memory the saves shared by all editor sessions may use before evicting unused ones
+SHARED_SAVES_MAX_BYTES = int(
+    os.environ.get("F1M_SHARED_SAVES_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+)
+
+# Read tables with the smallest dtypes holding their values, see compact_dtypes
+COMPACT_TABLES = os.environ.get("F1M_COMPACT_TABLES", "0") == "1"
@@ -1,12 +1,27 @@
 """Helper class for handling translated tables in the editor."""
+import hashlib
+import threading
 import typing as tp
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
 
 import pandas as pd
 
-from common.column_translators import COLUMN_TRANSLATORS
-from common.constants import FAKE_PATH_F1M, PATH_COMPANION_TABLES, PATH_SAVES
+from common.column_translators import COLUMN_TRANSLATORS, ColumnTranslator
+from common.compact_dtypes import expand_dtypes
+from common.constants import FAKE_PATH_F1M, PATH_SAVES
+from common.edit_log import EditLog
+from common.table_sets import FORMAT_FEATHER, write_table
+from common.table_store import TABLE_STORE_MAX_TABLES
+
+# Lookups shared by all saves and sessions, most foreign tables are static data
+# identical in every save (ex: Board_Enum_ObjectiveStates)
+SHARED_LOOKUPS_MAX = 256
+_shared_lookups: tp.OrderedDict[
+    tp.Tuple[ColumnTranslator, str], pd.Series
+] = OrderedDict()
+_shared_lookups_lock = threading.Lock()
 
 
 @dataclass
@@ -20,22 +35,87 @@ class TranslatedTable:
         return self.tmp_cols + self.id_cols
 
 
+def build_lookup(
+    tables: tp.Mapping[str, pd.DataFrame], translator: ColumnTranslator
+) -> pd.Series:
+    """Build the id -> translation lookup of a translator.
+
+    Args:
+        tables: all tables
+        translator: translation rules
+
+    Returns:
+        translations indexed on the foreign ids.
+    """
+    foreign_df = tables[translator.foreign_table_name]
+    if translator.func is None:
+        values = foreign_df[translator.foreign_value_col]
+    elif translator.vectorized:
+        values = translator.func(foreign_df)
+    else:
+        values = foreign_df.apply(translator.func, axis=1)
+    lookup = pd.Series(values.to_numpy(), index=foreign_df[translator.foreign_id_col])
+    return lookup[~lookup.index.duplicated()]
+
+
+def hash_table(df: pd.DataFrame) -> str:
+    """Hash the content of a table, columns included."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("|".join(str(x) for x in df.columns).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def get_lookup(
+    tables: tp.Mapping[str, pd.DataFrame], translator: ColumnTranslator
+) -> pd.Series:
+    """Get the lookup of a translator from the shared cache, or build it.
+
+    The cache is keyed on the content of the foreign table, so only save specific
+    tables (ex: Staff_BasicData) are built again when switching saves.
+    """
+    key = (translator, hash_table(tables[translator.foreign_table_name]))
+    with _shared_lookups_lock:
+        if key in _shared_lookups:
+            _shared_lookups.move_to_end(key)
+            return _shared_lookups[key]
+
+    lookup = build_lookup(tables, translator)
+    with _shared_lookups_lock:
+        _shared_lookups[key] = lookup
+        if len(_shared_lookups) > SHARED_LOOKUPS_MAX:
+            _shared_lookups.popitem(last=False)
+    return lookup
+
+
+def clear_shared_lookups():
+    """Empty the shared lookups, ex: to benchmark building them."""
+    with _shared_lookups_lock:
+        _shared_lookups.clear()
+
+
 def translate_db_ids(
-    tables: tp.Dict[str, pd.DataFrame],
+    tables: tp.Mapping[str, pd.DataFrame],
     selected_table: str,
+    lookups: tp.Dict[ColumnTranslator, pd.Series] | None = None,
 ) -> TranslatedTable:
     """Translate ID columns to explicit values to give context when editing.
 
-    Translated columns start with TMP_
+    Translated columns start with TMP_, IDs without translation are kept with an
+    empty translation.
 
     Args:
         tables: all tables
         selected_table: table to translate columns for
+        lookups: lookups of this save by translator, filled when missing
 
     Returns:
         dataframe with temporary translated columns.
     """
-    dataframe = tables[selected_table].copy(deep=True)
+    if lookups is None:
+        lookups = {}
+    # Only adds columns, the source table is never modified
+    dataframe = tables[selected_table].copy(deep=False)
     table_prefix = selected_table.split("_")[0]
     table_col_translators = COLUMN_TRANSLATORS.get(
         table_prefix, COLUMN_TRANSLATORS.get(table_prefix[:-1], {})
@@ -51,16 +131,9 @@ def translate_db_ids(
         if translator is None or selected_table == translator.foreign_table_name:
             continue
 
-        foreign_df = tables[translator.foreign_table_name].copy(deep=True)
-        foreign_df[translator.id_col] = foreign_df[translator.foreign_id_col]
-        foreign_df[translator.tmp_col] = (
-            foreign_df[translator.foreign_value_col]
-            if translator.func is None
-            else foreign_df.apply(translator.func, axis=1)
-        )
-        tl_cols = [translator.id_col, translator.tmp_col]
-        foreign_df = foreign_df[tl_cols]
-        dataframe = dataframe.merge(foreign_df, on=translator.id_col)
+        if translator not in lookups:
+            lookups[translator] = get_lookup(tables, translator)
+        dataframe[translator.tmp_col] = dataframe[id_col].map(lookups[translator])
         tmp_cols.append(translator.tmp_col)
         id_cols.append(translator.id_col)
 
@@ -73,35 +146,94 @@ def translate_db_ids(
 
 
 class TranslatedDatabase:
-    tables: tp.Dict[str, TranslatedTable]
+    """Tables translated on first access.
+
+    A bounded number of translated tables are kept in memory, least recently used
+    ones are translated again if needed.
+
+    Args:
+        tables: all tables, ex: a TableStore reading them on demand
+        max_tables: number of translated tables kept in memory. Defaults to
+            TABLE_STORE_MAX_TABLES, None to keep them all.
+    """
+
+    tables: tp.OrderedDict[str, TranslatedTable]
 
-    def __init__(self, tables: tp.Dict[str, pd.DataFrame]) -> None:
-        self.translate_tables(tables)
+    def __init__(
+        self,
+        tables: tp.Mapping[str, pd.DataFrame],
+        max_tables: int | None = TABLE_STORE_MAX_TABLES,
+    ) -> None:
+        self.source_tables = tables
+        self.max_tables = max_tables
+        self.tables = OrderedDict()
+        self._lock = threading.RLock()
+        # Built once per save, shared by all tables using the same translator
+        self.lookups: tp.Dict[ColumnTranslator, pd.Series] = {}
 
-    def translate_tables(self, tables: tp.Dict[str, pd.DataFrame]):
+    @property
+    def table_names(self) -> tp.List[str]:
+        return list(self.source_tables)
+
+    def get_table(self, table_name: str) -> TranslatedTable:
+        """Translate table if not done yet."""
+        with self._lock:
+            if table_name in self.tables:
+                self.tables.move_to_end(table_name)
+                return self.tables[table_name]
+            table = translate_db_ids(self.source_tables, table_name, self.lookups)
+            self.tables[table_name] = table
+            if self.max_tables is not None and len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+            return table
+
+    def translate_tables(self):
         """Translate all tables."""
-        self.tables = {}
-        for table_name in tables:
-            self.tables[table_name] = translate_db_ids(tables, table_name)
+        for table_name in self.source_tables:
+            self.get_table(table_name)
+
+    def memory_usage(self) -> int:
+        """Bytes used by the translated tables."""
+        with self._lock:
+            tables = [x.dataframe for x in self.tables.values()]
+        return sum(int(x.memory_usage(deep=True).sum()) for x in tables)
 
     def clean_tables(self) -> tp.Dict[str, pd.DataFrame]:
-        """Clean all tables in database."""
+        """Clean the translated tables in memory, others are left untouched."""
+        with self._lock:
+            table_names = list(self.tables)
         clean_tables: tp.Dict[str, pd.DataFrame] = {}
-        for table_name in self.tables:
+        for table_name in table_names:
             clean_tables[table_name] = self.clean_table(table_name)
         return clean_tables
 
     def clean_table(self, table_name: str) -> pd.DataFrame:
         """Remove TMP_ columns from table."""
-        table = self.tables[table_name].dataframe
+        table = self.get_table(table_name).dataframe
         return table.drop(
             columns=[col for col in table.columns if col.startswith("TMP_")]
         )
 
-    def table_to_csv(self, table_name: str, folder_name: str) -> Path:
-        """Save edited table to csv file."""
-        folder_path = PATH_COMPANION_TABLES / folder_name
-        folder_path.mkdir(exist_ok=True)
-        path = (folder_path / table_name).with_suffix(".csv")
-        self.clean_table(table_name).to_csv(path, index=False)
+    def export_table(
+        self,
+        table_name: str,
+        folder_name: str,
+        edits: EditLog | None = None,
+        table_format: str = FORMAT_FEATHER,
+    ) -> Path:
+        """Save edited table to a table set, with the cell edits applied if given.
+
+        Args:
+            table_name: table to save
+            folder_name: table set to save the table to
+            edits: cell edits to apply. Defaults to None.
+            table_format: FORMAT_FEATHER, or FORMAT_CSV to share it.
+
+        Returns:
+            relative path where table was saved.
+        """
+        table = expand_dtypes(self.clean_table(table_name))
+        if edits is not None:
+            table = edits.apply(table_name, table)
+        path = write_table(table, folder_name, table_name, table_format)
         return FAKE_PATH_F1M / path.relative_to(PATH_SAVES)
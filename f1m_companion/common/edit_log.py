@@ -0,0 +1,105 @@
+"""Cell level log of the edits made to the tables of a save."""
+import typing as tp
+from dataclasses import dataclass, replace
+
+import pandas as pd
+
+RowKey = tp.Tuple[tp.Any, ...]
+
+
+@dataclass(frozen=True)
+class CellEdit:
+    table_name: str
+    key: RowKey
+    column: str
+    old: tp.Any
+    new: tp.Any
+
+
+def python_value(value: tp.Any) -> tp.Any:
+    """Convert numpy scalars to python values, NaN to None."""
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def row_keys(df: pd.DataFrame, key_cols: tp.List[str]) -> tp.List[RowKey]:
+    """Key of each row of df, in row order."""
+    return [
+        tuple(python_value(x) for x in row)
+        for row in df[key_cols].itertuples(index=False, name=None)
+    ]
+
+
+class EditLog:
+    """Edits of a save, one entry per edited cell.
+
+    Rows are identified by their primary key, or by all their original values for
+    tables without one. Editing a cell twice keeps its original value, and editing
+    it back to its original value drops the entry.
+    """
+
+    def __init__(self) -> None:
+        self.edits: tp.Dict[tp.Tuple[str, RowKey, str], CellEdit] = {}
+        self.key_cols: tp.Dict[str, tp.List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.edits)
+
+    def __iter__(self) -> tp.Iterator[CellEdit]:
+        return iter(self.edits.values())
+
+    @property
+    def table_names(self) -> tp.List[str]:
+        return sorted({x.table_name for x in self.edits.values()})
+
+    def record(self, edit: CellEdit, key_cols: tp.List[str]):
+        """Record the edit of a cell.
+
+        Args:
+            edit: table, row key, column, value before and after the edit
+            key_cols: columns the row key is made of
+        """
+        self.key_cols[edit.table_name] = key_cols
+        index = (edit.table_name, edit.key, edit.column)
+        if index in self.edits:
+            edit = replace(edit, old=self.edits[index].old)
+        if edit.new == edit.old:
+            self.edits.pop(index, None)
+        else:
+            self.edits[index] = edit
+
+    def merge(self, other: "EditLog"):
+        """Record all edits of other, on top of these ones."""
+        for edit in other:
+            self.record(edit, other.key_cols[edit.table_name])
+
+    def table_edits(self, table_name: str) -> tp.List[CellEdit]:
+        return [x for x in self.edits.values() if x.table_name == table_name]
+
+    def apply(self, table_name: str, df: pd.DataFrame) -> pd.DataFrame:
+        """Apply the edits of a table to a copy of its original content.
+
+        Args:
+            table_name: table df is the content of
+            df: original content of the table, or some of its rows, ex: a page.
+                Edits of other rows are skipped.
+
+        Returns:
+            df with the edits, or df itself if there are none.
+        """
+        edits = self.table_edits(table_name)
+        if not edits:
+            return df
+        positions: tp.Dict[RowKey, int] = {}
+        for i, key in enumerate(row_keys(df, self.key_cols[table_name])):
+            # First copy of identical rows, the one write_cell_edits updates
+            positions.setdefault(key, i)
+        if not any(x.key in positions for x in edits):
+            return df
+        df = df.copy()
+        for edit in edits:
+            if edit.key not in positions:
+                continue
+            df.iat[positions[edit.key], df.columns.get_loc(edit.column)] = edit.new
+        return df
@@ -1,8 +1,11 @@
+import os
 from pathlib import Path
 
 import streamlit as st
 
 import common.constants as cst
+from common import auto_import
+from common.constants import COMPRESS_WORKERS
 
 
 def init_paths():
@@ -15,7 +18,24 @@ def init_paths():
 def init_page():
     """Initialize the pages with the sidebar."""
     st.set_page_config(layout="wide")
+    auto_import.start()
 
     with st.sidebar:
         st.title("Settings")
         st.session_state.display_help = st.checkbox("Display help", value=True)
+        st.session_state.compression_level = st.slider(
+            "Save compression level",
+            min_value=1,
+            max_value=9,
+            value=6,
+            help="1 repacks fastest, good for testing edits. "
+            "9 makes the smallest save file.",
+        )
+        st.session_state.compress_workers = st.number_input(
+            "Compression threads",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=COMPRESS_WORKERS,
+            help="1 writes a single zlib stream, like the game. More threads "
+            "compress blocks in parallel, faster on large saves, slightly bigger.",
+        )
@@ -0,0 +1,121 @@
+"""Background jobs, ex: imports and repacks, run by a worker pool shared by sessions.
+
+Jobs are stored in a SQLite table, so pages only submit them and poll their status,
+and they outlive browser refreshes. Progress of running jobs is kept in memory, fed
+by the byte counters of the copy, unpack and pack functions.
+"""
+import sqlite3
+import threading
+import time
+import typing as tp
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from common.constants import FILE_COMPANION_JOBS, JOB_WORKERS
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+# Queued or running when the app stopped
+STATUS_INTERRUPTED = "interrupted"
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="jobs")
+_progress: tp.Dict[int, tp.Tuple[int, int]] = {}
+_progress_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    FILE_COMPANION_JOBS.parent.mkdir(parents=True, exist_ok=True)
+    sql_conn = sqlite3.connect(FILE_COMPANION_JOBS, timeout=30)
+    sql_conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "kind TEXT, description TEXT, status TEXT, done_bytes INTEGER, "
+        "total_bytes INTEGER, result TEXT, error TEXT, created REAL, updated REAL)"
+    )
+    return sql_conn
+
+
+def _update(job_id: int, **fields: tp.Any):
+    fields["updated"] = time.time()
+    assignments = ", ".join(f"{x} = ?" for x in fields)
+    with _connect() as sql_conn:
+        sql_conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id]
+        )
+    sql_conn.close()
+
+
+def _run(job_id: int, func: tp.Callable[..., tp.Any], args, kwargs):
+    def progress(done: int, total: int):
+        with _progress_lock:
+            _progress[job_id] = (done, total)
+
+    _update(job_id, status=STATUS_RUNNING)
+    try:
+        result = func(*args, progress=progress, **kwargs)
+        status, fields = STATUS_DONE, {"result": str(result)}
+    except Exception as e:
+        status, fields = STATUS_FAILED, {"error": repr(e)}
+    with _progress_lock:
+        done, total = _progress.pop(job_id, (0, 0))
+    _update(job_id, status=status, done_bytes=done, total_bytes=total, **fields)
+
+
+def submit(
+    kind: str, description: str, func: tp.Callable[..., tp.Any], *args, **kwargs
+) -> int:
+    """Queue a job, run as func(*args, progress=callback, **kwargs).
+
+    Args:
+        kind: type of job, ex: import
+        description: shown to users
+        func: runs the job, its progress argument is called with (done, total)
+
+    Returns:
+        id of the job.
+    """
+    now = time.time()
+    with _connect() as sql_conn:
+        cursor = sql_conn.execute(
+            "INSERT INTO jobs (kind, description, status, created, updated) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [kind, description, STATUS_QUEUED, now, now],
+        )
+    sql_conn.close()
+    job_id = tp.cast(int, cursor.lastrowid)
+    _executor.submit(_run, job_id, func, args, kwargs)
+    return job_id
+
+
+def load(limit: int = 20) -> pd.DataFrame:
+    """Query the latest jobs, with the progress of running ones.
+
+    Returns:
+        one row per job indexed on its id, latest first.
+    """
+    sql_conn = _connect()
+    df = pd.read_sql_query(
+        "SELECT * FROM jobs ORDER BY id DESC LIMIT ?", sql_conn, params=[limit]
+    )
+    sql_conn.close()
+    df = df.fillna({"done_bytes": 0, "total_bytes": 0, "result": "", "error": ""})
+    with _progress_lock:
+        progress = dict(_progress)
+    for job_id, (done, total) in progress.items():
+        df.loc[df["id"] == job_id, ["done_bytes", "total_bytes"]] = [done, total]
+    return df.set_index("id")
+
+
+def _interrupt_previous_jobs():
+    """Jobs of a previous run of the app will never finish."""
+    with _connect() as sql_conn:
+        sql_conn.execute(
+            "UPDATE jobs SET status = ? WHERE status IN (?, ?)",
+            [STATUS_INTERRUPTED, STATUS_QUEUED, STATUS_RUNNING],
+        )
+    sql_conn.close()
+
+
+_interrupt_previous_jobs()
@@ -0,0 +1,317 @@
+"""Compare two save files table by table.
+
+Both databases are attached to a single sqlite connection and each table is first
+compared in sqlite, row by row on their rowid, only tables that differ are read in
+pandas. Their rows are matched on their primary key and compared through vectorized
+row hashes, only the rows whose hash changed are compared cell by cell. Tables without
+primary key are compared as multisets of rows, reporting added and removed rows only.
+
+Run from f1m_companion, ex:
+    python -m common.save_diff /path/to/before.sav /path/to/after.sav
+"""
+import argparse
+import sqlite3
+import typing as tp
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+
+from common.savefile import OriginalSaveFile, SaveFile
+from common.table_store import TableStore
+
+STATUS_IDENTICAL = "identical"
+STATUS_CHANGED = "changed"
+STATUS_ADDED = "added"
+STATUS_REMOVED = "removed"
+CELLS_COLUMNS = ["key", "column", "old", "new"]
+# Schema of the second save file, attached to the connection of the first one
+OTHER_SCHEMA = "other"
+
+
+@dataclass
+class TableDiff:
+    """Changes of a table.
+
+    Args:
+        added: key columns of the rows added, all columns for tables without key
+        removed: key columns of the rows removed, all columns for tables without key
+        cells: key as a tuple, column, old and new value of the cells changed
+    """
+
+    added: pd.DataFrame
+    removed: pd.DataFrame
+    cells: pd.DataFrame
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.cells)
+
+
+@dataclass
+class SaveDiff:
+    """Changes between two save files.
+
+    Args:
+        summary: one row per table with its status and number of changes
+        tables: changes of the changed tables
+    """
+
+    summary: pd.DataFrame
+    tables: tp.Dict[str, TableDiff]
+
+    @property
+    def cells(self) -> pd.DataFrame:
+        """Table, key, column, old and new value of all the cells changed."""
+        cells = [x.cells.assign(table=k) for k, x in self.tables.items()]
+        if not cells:
+            return pd.DataFrame(columns=["table", *CELLS_COLUMNS])
+        return pd.concat(cells, ignore_index=True)[["table", *CELLS_COLUMNS]]
+
+
+def _row_hashes(df: pd.DataFrame) -> pd.Series:
+    return pd.util.hash_pandas_object(df, index=False)
+
+
+def _keys(index: pd.Index) -> tp.List[tp.Tuple[tp.Any, ...]]:
+    return [x if isinstance(x, tuple) else (x,) for x in index]
+
+
+def diff_table(
+    before: pd.DataFrame, after: pd.DataFrame, pk: tp.List[str]
+) -> TableDiff:
+    """Find rows added, removed and cells changed between two versions of a table.
+
+    Args:
+        before: table in the first save
+        after: table in the second save
+        pk: primary key columns, empty to compare rows as a whole
+
+    Returns:
+        changes of the table, only columns in both versions are compared.
+    """
+    columns = [x for x in before.columns if x in after.columns]
+    if (
+        not pk
+        or not set(pk) <= set(columns)
+        or before.duplicated(pk).any()
+        or after.duplicated(pk).any()
+    ):
+        # Rows without key, keep one entry per copy of a row
+        hashes_before = _row_hashes(before[columns])
+        hashes_after = _row_hashes(after[columns])
+        occurence_before = hashes_before.groupby(hashes_before).cumcount()
+        occurence_after = hashes_after.groupby(hashes_after).cumcount()
+        ids_before = pd.MultiIndex.from_arrays([hashes_before, occurence_before])
+        ids_after = pd.MultiIndex.from_arrays([hashes_after, occurence_after])
+        return TableDiff(
+            after[columns][~ids_after.isin(ids_before)],
+            before[columns][~ids_before.isin(ids_after)],
+            pd.DataFrame(columns=CELLS_COLUMNS),
+        )
+
+    value_cols = [x for x in columns if x not in pk]
+    before = before[columns].set_index(pk)
+    after = after[columns].set_index(pk)
+    cells = []
+    # Tables of keys only, ex: link tables, have no cells to change
+    if value_cols:
+        common = before.index.intersection(after.index)
+        before_common = before.loc[common, value_cols]
+        after_common = after.loc[common, value_cols]
+        changed = (
+            _row_hashes(before_common).to_numpy()
+            != _row_hashes(after_common).to_numpy()
+        )
+        before_changed = before_common[changed]
+        after_changed = after_common[changed]
+    for col in value_cols:
+        old, new = before_changed[col], after_changed[col]
+        mask = (old != new) & ~(old.isna() & new.isna())
+        if mask.any():
+            cells.append(
+                pd.DataFrame(
+                    {
+                        "key": _keys(old.index[mask]),
+                        "column": col,
+                        "old": old[mask].to_numpy(),
+                        "new": new[mask].to_numpy(),
+                    }
+                )
+            )
+    return TableDiff(
+        after.index.difference(before.index).to_frame(index=False),
+        before.index.difference(after.index).to_frame(index=False),
+        pd.concat(cells, ignore_index=True)
+        if cells
+        else pd.DataFrame(columns=CELLS_COLUMNS),
+    )
+
+
+def attach(sql_conn: sqlite3.Connection, other: sqlite3.Connection, schema: str):
+    """Attach the main database of another connection, without copying it if a file.
+
+    In-memory databases, ex: with UNPACK_IN_MEMORY, are copied in the attached schema.
+    """
+    path = next(x[2] for x in other.execute("PRAGMA database_list") if x[1] == "main")
+    # sqlite reports the full path of files, a dummy name for deserialized databases
+    if Path(path).is_absolute():
+        sql_conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+    else:
+        sql_conn.execute(f"ATTACH DATABASE ':memory:' AS {schema}")
+        sql_conn.deserialize(other.serialize(), name=schema)
+
+
+def tables_differ(
+    sql_conn: sqlite3.Connection, table_name: str, columns: tp.List[str], schema: str
+) -> bool:
+    """Compare a table of the main and attached databases in sqlite.
+
+    Rows are matched on their rowid, a single pass over both tables without sorting
+    them, so rows moved to another rowid are reported as different. Tables without
+    rowid are compared as multisets, grouping rows with their number of copies.
+
+    Returns:
+        False if the tables hold the same rows, True if they may differ.
+    """
+    table = f'"{table_name}"'
+    (count_main,) = sql_conn.execute(f"SELECT count(*) FROM main.{table}").fetchone()
+    (count_other,) = sql_conn.execute(
+        f"SELECT count(*) FROM {schema}.{table}"
+    ).fetchone()
+    if count_main != count_other or not columns:
+        return bool(count_main != count_other)
+
+    same = " AND ".join(f'a."{x}" IS b."{x}"' for x in columns)
+    query = (
+        f"SELECT count(*) FROM main.{table} AS a JOIN {schema}.{table} AS b "
+        f"ON a.rowid = b.rowid WHERE {same}"
+    )
+    try:
+        (count_same,) = sql_conn.execute(query).fetchone()
+        return bool(count_same != count_main)
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID table
+        pass
+    cols = ", ".join(f'"{x}"' for x in columns)
+    query = (
+        f"SELECT 1 FROM (SELECT {cols}, count(*) FROM main.{table} GROUP BY {cols} "
+        f"EXCEPT SELECT {cols}, count(*) FROM {schema}.{table} GROUP BY {cols}) "
+        "LIMIT 1"
+    )
+    return sql_conn.execute(query).fetchone() is not None
+
+
+def diff_saves(
+    before: SaveFile, after: SaveFile, table_names: tp.Iterable[str] | None = None
+) -> SaveDiff:
+    """Compare the tables of two save files.
+
+    Args:
+        before: first save file
+        after: second save file
+        table_names: tables to compare. Defaults to None, all tables.
+
+    Returns:
+        changes between the save files.
+    """
+    summary: tp.List[tp.Dict[str, tp.Any]] = []
+    tables: tp.Dict[str, TableDiff] = {}
+    with before.unpack() as conn_before, after.unpack() as conn_after:
+        store_before = TableStore(nullcontext(conn_before), max_tables=0, compact=False)
+        store_after = TableStore(nullcontext(conn_after), max_tables=0, compact=False)
+        attach(conn_before, conn_after, OTHER_SCHEMA)
+        try:
+            if table_names is None:
+                table_names = sorted(
+                    set(store_before.table_names) | set(store_after.table_names)
+                )
+            for table_name in table_names:
+                if table_name not in store_after.table_names:
+                    summary.append({"table": table_name, "status": STATUS_REMOVED})
+                    continue
+                if table_name not in store_before.table_names:
+                    summary.append({"table": table_name, "status": STATUS_ADDED})
+                    continue
+                columns_after = store_after.columns(table_name)
+                columns = [
+                    x for x in store_before.columns(table_name) if x in columns_after
+                ]
+                if not tables_differ(conn_before, table_name, columns, OTHER_SCHEMA):
+                    summary.append({"table": table_name, "status": STATUS_IDENTICAL})
+                    continue
+
+                table_diff = diff_table(
+                    store_before.read_table(table_name),
+                    store_after.read_table(table_name),
+                    store_after.primary_key(table_name),
+                )
+                if not len(table_diff):
+                    # Same rows under other rowids, or columns added or removed
+                    summary.append({"table": table_name, "status": STATUS_IDENTICAL})
+                    continue
+                tables[table_name] = table_diff
+                summary.append(
+                    {
+                        "table": table_name,
+                        "status": STATUS_CHANGED,
+                        "rows_added": len(table_diff.added),
+                        "rows_removed": len(table_diff.removed),
+                        "rows_changed": table_diff.cells["key"].nunique(),
+                        "cells_changed": len(table_diff.cells),
+                    }
+                )
+        finally:
+            conn_before.execute(f"DETACH DATABASE {OTHER_SCHEMA}")
+
+    summary_df = pd.DataFrame(
+        summary,
+        columns=[
+            "table",
+            "status",
+            "rows_added",
+            "rows_removed",
+            "rows_changed",
+            "cells_changed",
+        ],
+    )
+    count_cols = summary_df.columns[2:]
+    summary_df[count_cols] = summary_df[count_cols].fillna(0).astype(int)
+    return SaveDiff(summary_df, tables)
+
+
+def main(before, after, tables, max_rows):
+    save_diff = diff_saves(
+        OriginalSaveFile(Path(before)), OriginalSaveFile(Path(after)), tables
+    )
+    changed = save_diff.summary[save_diff.summary["status"] != STATUS_IDENTICAL]
+    print(f"{len(save_diff.summary) - len(changed)} identical tables")
+    print(changed.to_string(index=False))
+    for table_name, table_diff in save_diff.tables.items():
+        for change, df in (
+            ("Rows added", table_diff.added),
+            ("Rows removed", table_diff.removed),
+            ("Cells changed", table_diff.cells),
+        ):
+            if len(df):
+                print(f"\n{change} in {table_name}")
+                print(df.to_string(index=False, max_rows=max_rows))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare F1 Manager Save Files.")
+    parser.add_argument("before", help="Full path to the first save file.")
+    parser.add_argument("after", help="Full path to the second save file.")
+    parser.add_argument(
+        "--tables",
+        help="Tables to compare. Defaults to all tables.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--max-rows",
+        help="Number of changed rows and cells printed.",
+        type=int,
+        default=50,
+    )
+    args = parser.parse_args()
+    main(args.before, args.after, args.tables, args.max_rows)
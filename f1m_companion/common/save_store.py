@@ -0,0 +1,260 @@
+"""Deduplicated storage of the companion save files.
+
+A companion save file is stored as a manifest listing the blobs of its chunk1 and of
+its databases, cut in blocks of BLOB_SIZE bytes. Blobs are zlib compressed files in
+PATH_COMPANION_BLOBS named after the hash of their content, so blocks identical
+between autosaves of a career, or edited versions of a save, are stored once.
+
+The save file is rebuilt from its manifest in PATH_COMPANION_BUILDS when needed,
+only the last COMPANION_BUILDS_MAX builds are kept, and the builds in use. A save
+file is identified by the hash of its manifest, the same whichever build is read.
+
+Blobs no manifest of PATH_COMPANION_SAVES refers to are deleted, mark and sweep, when
+a manifest is replaced or deleted. Storing and building save files hold a shared lock
+on the blob store, so blobs written before their manifest are never collected.
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import typing as tp
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+from common.constants import (
+    COMPANION_BUILDS_MAX,
+    COMPRESS_WORKERS,
+    PATH_COMPANION_BLOBS,
+    PATH_COMPANION_BUILDS,
+    PATH_COMPANION_SAVES,
+)
+from common.xaranaktu.unpacking import (
+    BLOCK_SIZE,
+    CHNUK1_NAME,
+    DB_HEADER,
+    DB_NAMES,
+    ProgressCallback,
+    iter_databases,
+    process_repack,
+    read_header,
+)
+
+MANIFEST_SUFFIX = ".json"
+# Small enough for edits to only change a few blocks of a database
+BLOB_SIZE = BLOCK_SIZE
+BLOB_LEVEL = 6
+
+
+@contextmanager
+def _lock_blobs(operation: int) -> tp.Generator[None, None, None]:
+    """Lock the blob store, shared to read and write blobs, exclusive to collect."""
+    PATH_COMPANION_BLOBS.mkdir(parents=True, exist_ok=True)
+    lock_fd = os.open(PATH_COMPANION_BLOBS.with_suffix(".lock"), os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(lock_fd, operation)
+        yield
+    finally:
+        os.close(lock_fd)
+
+
+def write_blob(data: bytes) -> str:
+    """Store data in the blob store if not there yet.
+
+    Returns:
+        id of the blob, the hash of data.
+    """
+    blob_id = hashlib.blake2b(data, digest_size=20).hexdigest()
+    path = PATH_COMPANION_BLOBS / blob_id[:2] / blob_id
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(zlib.compress(data, BLOB_LEVEL))
+        os.replace(f.name, path)
+    return blob_id
+
+
+def manifest_id(manifest: bytes) -> str:
+    """Hash of a manifest, the identity of its save file."""
+    return hashlib.blake2b(manifest, digest_size=16).hexdigest()
+
+
+def read_blob(blob_id: str) -> bytes:
+    with open(PATH_COMPANION_BLOBS / blob_id[:2] / blob_id, "rb") as f:
+        return zlib.decompress(f.read())
+
+
+def store_save_file(
+    src: Path, manifest_path: Path, progress: ProgressCallback | None = None
+) -> Path:
+    """Store a save file in the blob store and write its manifest.
+
+    Args:
+        src: save file to store
+        manifest_path: path of the manifest in PATH_COMPANION_SAVES, overwritten if
+            it exists, then the blobs only it referred to are deleted
+        progress: called with (decompressed bytes, total bytes)
+
+    Returns:
+        path of the manifest.
+    """
+    replaced = manifest_path.exists()
+    with _lock_blobs(fcntl.LOCK_SH):
+        _store_save_file(src, manifest_path, progress)
+    if replaced:
+        collect_garbage()
+    return manifest_path
+
+
+def _store_save_file(src: Path, manifest_path: Path, progress: ProgressCallback | None):
+    with open(src, "rb") as f:
+        with mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ) as mm:
+            db_section_off, db_sizes = read_header(mm)
+            chunk1 = write_blob(mm[:db_section_off])
+
+        databases: tp.Dict[str, tp.List[str]] = {name: [] for name in DB_NAMES}
+        f.seek(db_section_off + DB_HEADER.size)
+        total = sum(db_sizes)
+        done = 0
+        current_index = 0
+        buffer = bytearray()
+        for index, data in iter_databases(f, db_sizes):
+            if index != current_index:
+                if buffer:
+                    databases[DB_NAMES[current_index]].append(write_blob(buffer))
+                buffer = bytearray()
+                current_index = index
+            buffer += data
+            while len(buffer) >= BLOB_SIZE:
+                databases[DB_NAMES[index]].append(write_blob(buffer[:BLOB_SIZE]))
+                del buffer[:BLOB_SIZE]
+            done += len(data)
+            if progress is not None:
+                progress(done, total)
+        if buffer:
+            databases[DB_NAMES[current_index]].append(write_blob(buffer))
+
+    manifest = {"chunk1": chunk1, "databases": databases}
+    with tempfile.NamedTemporaryFile(
+        "w", dir=manifest_path.parent, suffix=".tmp", delete=False
+    ) as f_manifest:
+        json.dump(manifest, f_manifest)
+    os.replace(f_manifest.name, manifest_path)
+
+
+def delete_save_file(manifest_path: Path):
+    """Delete a manifest, and the blobs only it referred to."""
+    manifest_path.unlink()
+    collect_garbage()
+
+
+def collect_garbage() -> int:
+    """Delete the blobs no manifest of PATH_COMPANION_SAVES refers to.
+
+    Returns:
+        number of blobs deleted.
+    """
+    with _lock_blobs(fcntl.LOCK_EX):
+        referenced: tp.Set[str] = set()
+        for manifest_path in PATH_COMPANION_SAVES.glob(f"*{MANIFEST_SUFFIX}"):
+            manifest = json.loads(manifest_path.read_bytes())
+            referenced.add(manifest["chunk1"])
+            for blob_ids in manifest["databases"].values():
+                referenced.update(blob_ids)
+
+        deleted = 0
+        # Also removes temporary files left by interrupted writes
+        for path in PATH_COMPANION_BLOBS.glob("*/*"):
+            if path.name not in referenced:
+                path.unlink()
+                deleted += 1
+    return deleted
+
+
+def _is_current(lock_fd: int, lock_path: Path) -> bool:
+    """Whether the locked file is still at lock_path, not deleted by evict_builds."""
+    try:
+        return os.fstat(lock_fd).st_ino == os.stat(lock_path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _build(manifest: tp.Dict[str, tp.Any], build_path: Path):
+    with _lock_blobs(fcntl.LOCK_SH), tempfile.TemporaryDirectory() as tmp_dir_str:
+        tmp_dir = Path(tmp_dir_str)
+        (tmp_dir / CHNUK1_NAME).write_bytes(read_blob(manifest["chunk1"]))
+        for name, blob_ids in manifest["databases"].items():
+            if not blob_ids:
+                continue
+            with open(tmp_dir / name, "wb") as f:
+                for blob_id in blob_ids:
+                    f.write(read_blob(blob_id))
+        process_repack(tmp_dir, build_path, workers=COMPRESS_WORKERS)
+
+
+@contextmanager
+def use_build(manifest_path: Path) -> tp.Generator[Path, None, None]:
+    """Rebuild the save file of a manifest if needed, and keep it while in context.
+
+    Builds in use hold a shared lock, evict_builds only deletes the others. Can be
+    nested on the same manifest.
+
+    Yields:
+        path of the save file built.
+    """
+    manifest = manifest_path.read_bytes()
+    PATH_COMPANION_BUILDS.mkdir(parents=True, exist_ok=True)
+    build_path = PATH_COMPANION_BUILDS / f"{manifest_id(manifest)}.sav"
+    lock_path = build_path.with_suffix(".lock")
+    built = False
+    while True:
+        lock_fd = os.open(lock_path, os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            if not build_path.exists() and _is_current(lock_fd, lock_path):
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                if not build_path.exists() and _is_current(lock_fd, lock_path):
+                    _build(json.loads(manifest), build_path)
+                    built = True
+                fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            # Evicted while the lock was released, or while opening it
+            if build_path.exists() and _is_current(lock_fd, lock_path):
+                break
+        except BaseException:
+            os.close(lock_fd)
+            raise
+        os.close(lock_fd)
+
+    try:
+        # The mtime of the lock tracks the last use
+        os.utime(lock_path)
+        yield build_path
+    finally:
+        os.close(lock_fd)
+    if built:
+        evict_builds()
+
+
+def evict_builds(max_builds: int = COMPANION_BUILDS_MAX):
+    """Delete least recently used builds not in use, keeping max_builds of them."""
+    locks = sorted(
+        PATH_COMPANION_BUILDS.glob("*.lock"), key=lambda x: x.stat().st_mtime
+    )
+    for lock_path in locks[: max(0, len(locks) - max_builds)]:
+        try:
+            lock_fd = os.open(lock_path, os.O_RDWR)
+        except FileNotFoundError:
+            # Evicted by another process
+            continue
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if _is_current(lock_fd, lock_path):
+                lock_path.with_suffix(".sav").unlink(missing_ok=True)
+                lock_path.unlink()
+        except BlockingIOError:
+            # In use, or being built
+            continue
+        finally:
+            os.close(lock_fd)
@@ -1,15 +1,266 @@
 import sqlite3
 import tempfile
 import typing as tp
+import zlib
 from abc import ABC
-from contextlib import contextmanager
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
 
 import pandas as pd
 import pendulum
+from pandas.api.types import is_float_dtype, is_numeric_dtype
 
-from common.constants import FAKE_PATH_F1M, PATH_COMPANION_SAVES, PATH_SAVES
-from common.xaranaktu.unpacking import process_repack, process_unpack
+from common.compact_dtypes import expand_dtypes
+from common.constants import (
+    COMPACT_TABLES,
+    FAKE_PATH_F1M,
+    PATH_COMPANION_SAVES,
+    PATH_SAVES,
+    UNPACK_IN_MEMORY,
+)
+from common.edit_log import EditLog
+from common.save_store import MANIFEST_SUFFIX, manifest_id, use_build
+from common.table_store import (
+    TABLE_STORE_MAX_TABLES,
+    TableStore,
+    column_affinities,
+    primary_key,
+)
+from common.unpack_cache import cache_key, cached_unpack, clone_unpacked
+from common.watcher import save_games_watcher
+from common.xaranaktu.unpacking import (
+    BACKUP_DB_NAMES,
+    MAIN_DB_NAME,
+    ProgressCallback,
+    pack_to_file,
+    packed_databases,
+    phase_progress,
+    process_repack,
+    unpack_to_memory,
+)
+
+# Rows inserted at once when reloading a table
+BULK_LOAD_CHUNK_ROWS = 50_000
+
+
+def coerce_to_affinity(df: pd.DataFrame, affinities: tp.Dict[str, str]) -> pd.DataFrame:
+    """Convert columns to the dtype matching their sqlite affinity.
+
+    Tables read from csv files have their types inferred again, ex: an INTEGER
+    column with empty cells is read as float, or a TEXT column of digits as int.
+
+    Raises:
+        ValueError: a value can't be converted to a number for a numeric column.
+    """
+    df = expand_dtypes(df).copy(deep=False)
+    for col, affinity in affinities.items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if affinity in ("INTEGER", "REAL") and not is_numeric_dtype(values):
+            try:
+                values = pd.to_numeric(values)
+            except ValueError as e:
+                raise ValueError(f"Column {col} should only hold numbers") from e
+        if affinity in ("INTEGER", "TEXT") and is_float_dtype(values):
+            if (values.dropna() % 1 == 0).all():
+                values = values.astype("Int64")
+        if affinity == "REAL" and not is_float_dtype(values):
+            values = values.astype(float)
+        if affinity == "TEXT" and is_numeric_dtype(values):
+            values = values.astype(object).where(values.isna(), values.astype(str))
+        df[col] = values
+    return df
+
+
+def bulk_load_table(
+    sql_conn: sqlite3.Connection,
+    table_name: str,
+    table: pd.DataFrame,
+    chunk_rows: int = BULK_LOAD_CHUNK_ROWS,
+):
+    """Replace all rows of a table, keeping its original definition.
+
+    Columns are converted to their declared affinity, and rows inserted in chunks
+    of chunk_rows. Does not commit.
+
+    Args:
+        sql_conn: connection to the unpacked database
+        table_name: table to replace the content of
+        table: new content of the table
+        chunk_rows: number of rows inserted at once
+    """
+    table = coerce_to_affinity(table, column_affinities(sql_conn, table_name))
+    cols = ", ".join(f'"{x}"' for x in table.columns)
+    query = (
+        f'INSERT INTO "{table_name}" ({cols}) '
+        f"VALUES ({', '.join('?' * len(table.columns))})"
+    )
+    sql_conn.execute(f'DELETE FROM "{table_name}"')
+    for start in range(0, len(table), chunk_rows):
+        sql_conn.executemany(query, to_records(table.iloc[start : start + chunk_rows]))
+
+
+def to_records(df: pd.DataFrame) -> tp.List[tp.Tuple[tp.Any, ...]]:
+    """Convert rows to python values sqlite understands, NaN to NULL."""
+    return list(
+        df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+    )
+
+
+def write_table_diff(
+    sql_conn: sqlite3.Connection, table_name: str, table: pd.DataFrame
+) -> int:
+    """Write only the rows of table that differ from the database.
+
+    Rows are matched on the primary key, changed rows are updated, new rows inserted
+    and missing rows deleted, keeping the original table definition. Tables without
+    primary key, or with different columns, are rewritten entirely if they changed.
+    Does not commit.
+
+    Args:
+        sql_conn: connection to the unpacked database
+        table_name: table to write
+        table: new content of the table
+
+    Returns:
+        number of rows written or deleted.
+    """
+    original = pd.read_sql_query(f'SELECT * FROM "{table_name}"', sql_conn)
+    pk = primary_key(sql_conn, table_name)
+    table = coerce_to_affinity(table, column_affinities(sql_conn, table_name))
+    cols = ", ".join(f'"{x}"' for x in table.columns)
+    if (
+        not pk
+        or set(table.columns) != set(original.columns)
+        or table.duplicated(pk).any()
+    ):
+        if original.equals(table):
+            return 0
+        bulk_load_table(sql_conn, table_name, table)
+        return len(original) + len(table)
+
+    value_cols = [x for x in table.columns if x not in pk]
+    new = table.set_index(pk)
+    original = original.set_index(pk)[value_cols]
+    deleted = original.index.difference(new.index)
+    inserted = new.index.difference(original.index)
+    common = new.index.intersection(original.index)
+    before = original.loc[common, value_cols]
+    # Keys read from csv files may have another dtype, ex: Int64
+    after = new.loc[common, value_cols].set_axis(before.index)
+    changed = ((before != after) & ~(before.isna() & after.isna())).any(axis=1)
+    updated = after[changed]
+
+    where = " AND ".join(f'"{x}" = ?' for x in pk)
+    if len(deleted):
+        sql_conn.executemany(
+            f'DELETE FROM "{table_name}" WHERE {where}',
+            to_records(deleted.to_frame(index=False)),
+        )
+    if len(updated) and value_cols:
+        assignments = ", ".join(f'"{x}" = ?' for x in value_cols)
+        sql_conn.executemany(
+            f'UPDATE "{table_name}" SET {assignments} WHERE {where}',
+            to_records(updated.reset_index()[value_cols + pk]),
+        )
+    if len(inserted):
+        sql_conn.executemany(
+            f'INSERT INTO "{table_name}" ({cols}) '
+            f"VALUES ({', '.join('?' * len(table.columns))})",
+            to_records(new.loc[inserted].reset_index()[list(table.columns)]),
+        )
+    return len(deleted) + len(updated) + len(inserted)
+
+
+def write_cell_edits(sql_conn: sqlite3.Connection, edits: EditLog) -> int:
+    """Write the edited cells in the database, without reading the tables.
+
+    Edits of a row are written by a single UPDATE, matching the row on its primary
+    key, or on its original values for tables without one, the first of identical
+    rows like EditLog.apply. Does not commit.
+
+    Args:
+        sql_conn: connection to the unpacked database
+        edits: cell edits to write
+
+    Returns:
+        number of rows updated.
+    """
+    rows: tp.Dict[tp.Tuple[str, tp.Tuple[tp.Any, ...]], tp.Dict[str, tp.Any]] = {}
+    for edit in edits:
+        rows.setdefault((edit.table_name, edit.key), {})[edit.column] = edit.new
+
+    # Rows with the same edited columns share their statement
+    statements: tp.Dict[tp.Tuple[str, tp.Tuple[str, ...]], tp.List[tp.Any]] = {}
+    for (table_name, key), changes in rows.items():
+        statements.setdefault((table_name, tuple(changes)), []).append(
+            (*changes.values(), *key)
+        )
+
+    for (table_name, columns), params in statements.items():
+        key_cols = edits.key_cols[table_name]
+        assignments = ", ".join(f'"{x}" = ?' for x in columns)
+        if primary_key(sql_conn, table_name):
+            where = " AND ".join(f'"{x}" = ?' for x in key_cols)
+        else:
+            match = " AND ".join(f'"{x}" IS ?' for x in key_cols)
+            where = (
+                f'rowid = (SELECT rowid FROM "{table_name}" WHERE {match} '
+                "ORDER BY rowid LIMIT 1)"
+            )
+        sql_conn.executemany(
+            f'UPDATE "{table_name}" SET {assignments} WHERE {where}', params
+        )
+    return len(rows)
+
+
+def save_day(sql_conn: sqlite3.Connection) -> str:
+    """In-game date of an unpacked save file, ex: 2023-03-17."""
+    row = pd.read_sql_query("SELECT * FROM Player_State", sql_conn).iloc[0]
+    return str(pendulum.date(1900, 1, 1).add(days=int(row["Day"])).to_date_string())
+
+
+def read_rich_fields(sql_conn: sqlite3.Connection) -> tp.Dict[str, str]:
+    """Descriptive fields of an unpacked save file.
+
+    Returns:
+        save_type, team, day, track, session and seed of the save.
+    """
+    query = "SELECT * FROM Player AS p JOIN Teams AS t ON p.TeamID = t.TeamID"
+    row = pd.read_sql_query(query, sql_conn).iloc[0]
+    save_type = (
+        "test"
+        if row["FirstName"] == "[TEAMPRINCIPAL_TEAM]"
+        else str("career_" + row["FirstName"] + "_" + row["LastName"])
+    )
+    team = row["TeamName"]
+    seed = str(row["UniqueSeed"])
+    day = save_day(sql_conn)
+    try:
+        query = (
+            "SELECT * FROM "
+            "Save_Weekend AS w JOIN Races AS r ON w.RaceID = r.RaceID "
+            "JOIN Races_Tracks AS t ON r.TrackID = t.TrackID"
+        )
+        row = pd.read_sql_query(query, sql_conn).iloc[0]
+        track = row["Name"]
+        session = str(row["WeekendStage"])
+    except IndexError:
+        track, session = "track", "session"
+    return {
+        "save_type": save_type,
+        "team": team,
+        "day": day,
+        "track": track,
+        "session": session,
+        "seed": seed,
+    }
+
+
+def format_rich_name(rich_fields: tp.Dict[str, str]) -> str:
+    """Join rich fields in a save file name."""
+    return "__".join(rich_fields.values()).replace(" ", "_")
 
 
 class SaveFile(ABC):
@@ -26,45 +277,213 @@ class SaveFile(ABC):
         return self.name < other.name
 
     @contextmanager
-    def unpack(self, target_dir: Path) -> tp.Generator[sqlite3.Connection, None, None]:
+    def readable_path(self) -> tp.Generator[Path, None, None]:
+        """Yield the path to read the save file at, valid while in context."""
+        yield self.path
+
+    @property
+    def identity(self) -> str:
+        """Identity of the save file in the unpack cache and the shared saves."""
+        return cache_key(self.path)
+
+    @contextmanager
+    def unpack(
+        self,
+        target_dir: Path | None = None,
+        progress: ProgressCallback | None = None,
+    ) -> tp.Generator[sqlite3.Connection, None, None]:
         """Unpack save file and yield sqlite connection.
 
+        Save files are only unpacked once in the shared unpack cache, or straight to
+        memory with UNPACK_IN_MEMORY.
+
         Args:
-            target_dir: unpack save file to dir
+            target_dir: clone unpacked save file to dir, to get an editable
+                database. Defaults to None, a read-only connection to the cache.
+            progress: called with (decompressed bytes, total bytes) if unpacked
 
         Yields:
             sqlite connection to unpacked database.
         """
-        process_unpack(self.path, target_dir)
-        save_unpacked = target_dir / "main.db"
-        sql_conn = sqlite3.connect(save_unpacked)
+        if target_dir is None and UNPACK_IN_MEMORY:
+            with self.unpack_in_memory(progress) as (_, sql_conn):
+                yield sql_conn
+            return
+
+        if target_dir is None:
+            with ExitStack() as stack:
+                # The unpacked entry stays in use, not the save file it came from
+                with self.readable_path() as path:
+                    entry = stack.enter_context(
+                        cached_unpack(path, progress, self.identity)
+                    )
+                uri = (entry / MAIN_DB_NAME).as_uri() + "?mode=ro&immutable=1"
+                sql_conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                try:
+                    yield sql_conn
+                finally:
+                    sql_conn.close()
+            return
+
+        with self.readable_path() as path:
+            clone_unpacked(path, target_dir, progress, self.identity)
+        sql_conn = sqlite3.connect(target_dir / MAIN_DB_NAME)
         try:
             yield sql_conn
         finally:
             sql_conn.close()
 
-    def repack(self, target_stem: str, tables: tp.Dict[str, pd.DataFrame]) -> Path:
-        """Repack tables to target location.
+    @contextmanager
+    def unpack_in_memory(
+        self, progress: ProgressCallback | None = None
+    ) -> tp.Generator[tp.Tuple[bytes, sqlite3.Connection], None, None]:
+        """Unpack save file without touching the disk and yield sqlite connection.
+
+        Only main.db is inflated, the rest of the zlib stream is not read. Meant for
+        save files read once, ex: when indexing or ingesting many of them, which
+        would evict the saves in use from the unpack cache.
+
+        Args:
+            progress: called with (decompressed bytes, total bytes)
+
+        Yields:
+            chunk1, and sqlite connection to an in-memory copy of main.db.
+        """
+        with self.readable_path() as path:
+            chunk1, dbs = unpack_to_memory(
+                path, progress=progress, databases={MAIN_DB_NAME}
+            )
+        sql_conn = sqlite3.connect(":memory:", check_same_thread=False)
+        try:
+            sql_conn.deserialize(dbs.pop(MAIN_DB_NAME))
+            yield chunk1, sql_conn
+        finally:
+            sql_conn.close()
+
+    @staticmethod
+    def write_tables(
+        sql_conn: sqlite3.Connection,
+        tables: tp.Dict[str, pd.DataFrame],
+        replace: bool = False,
+        edits: EditLog | None = None,
+    ):
+        """Write the changes made to tables in the unpacked database.
+
+        All tables are written in a single transaction. The database is a throwaway
+        copy, so journaling and syncing to disk are disabled.
+
+        Args:
+            sql_conn: connection to the unpacked database
+            tables: new content of the tables
+            replace: reload all rows of the tables, ex: for tables from csv files.
+                Defaults to False, only changed rows are written.
+            edits: cell edits, written after the tables. Defaults to None.
+        """
+        sql_conn.execute("PRAGMA journal_mode = OFF")
+        sql_conn.execute("PRAGMA synchronous = OFF")
+        with sql_conn:
+            for table_name, table in tables.items():
+                if replace:
+                    bulk_load_table(sql_conn, table_name, table)
+                else:
+                    write_table_diff(sql_conn, table_name, table)
+            if edits is not None:
+                write_cell_edits(sql_conn, edits)
 
-        Works by unpacking the original save file again, do not delete it !
+    def repack(
+        self,
+        target_stem: str,
+        tables: tp.Dict[str, pd.DataFrame],
+        level: int = zlib.Z_DEFAULT_COMPRESSION,
+        workers: int = 1,
+        replace: bool = False,
+        edits: EditLog | None = None,
+        progress: ProgressCallback | None = None,
+    ) -> Path:
+        """Repack tables to a save file of the SaveGames folder, see repack_to.
 
         Args:
             target_stem: new save file name
-            tables: tables to repack
 
         Returns:
             relative path where save file was repacked.
         """
-        with tempfile.TemporaryDirectory() as tmp_dir_str:
-            tmp_dir = Path(tmp_dir_str)
-            with self.unpack(tmp_dir) as sql_conn:
-                for table_name, table in tables.items():
-                    table.to_sql(table_name, sql_conn, if_exists="replace", index=False)
-                sql_conn.commit()
-                new_path = (PATH_SAVES / target_stem).with_suffix(".sav")
-                process_repack(tmp_dir, new_path)
+        new_path = (PATH_SAVES / target_stem).with_suffix(".sav")
+        self.repack_to(new_path, tables, level, workers, replace, edits, progress)
         return FAKE_PATH_F1M / new_path.relative_to(PATH_SAVES)
 
+    def repack_to(
+        self,
+        new_path: Path,
+        tables: tp.Dict[str, pd.DataFrame],
+        level: int = zlib.Z_DEFAULT_COMPRESSION,
+        workers: int = 1,
+        replace: bool = False,
+        edits: EditLog | None = None,
+        progress: ProgressCallback | None = None,
+    ) -> Path:
+        """Repack tables to target location.
+
+        Works from a clone of the unpacked original save file, and carries its
+        backup databases over, do not delete it !
+
+        Args:
+            new_path: save file to write
+            tables: tables to repack
+            level: zlib compression level, 1 is fastest, 9 is smallest
+            workers: number of threads compressing in parallel
+            replace: reload all rows of the tables instead of only changed ones
+            edits: cell edits to write on top of tables
+            progress: called with (bytes done, total bytes), unpacking is the first
+                half and packing the second half
+
+        Returns:
+            path of the repacked save file.
+        """
+        unpack_progress = phase_progress(progress, 0, 2)
+        pack_progress = phase_progress(progress, 1, 2)
+        # Backups are read from the save file while packing
+        with self.readable_path() as path:
+            if UNPACK_IN_MEMORY:
+                with self.unpack_in_memory(unpack_progress) as (chunk1, sql_conn):
+                    self.write_tables(sql_conn, tables, replace, edits)
+                    main_db = sql_conn.serialize()
+                backups = packed_databases(path, BACKUP_DB_NAMES)
+                dbs = [main_db, *backups.values()]
+                pack_to_file(
+                    chunk1,
+                    dbs,
+                    new_path,
+                    level,
+                    workers=workers,
+                    progress=pack_progress,
+                )
+                return new_path
+
+            with tempfile.TemporaryDirectory() as tmp_dir_str:
+                tmp_dir = Path(tmp_dir_str)
+                with self.unpack(tmp_dir, unpack_progress) as sql_conn:
+                    self.write_tables(sql_conn, tables, replace, edits)
+                process_repack(
+                    tmp_dir,
+                    new_path,
+                    level,
+                    workers=workers,
+                    progress=pack_progress,
+                    original_file=path,
+                )
+        return new_path
+
+    @property
+    def rich_fields(self) -> tp.Dict[str, str]:
+        """Parse save file to extract descriptive fields about the save.
+
+        Returns:
+            save_type, team, day, track, session and seed of the save.
+        """
+        with self.unpack() as sql_conn:
+            return read_rich_fields(sql_conn)
+
     @property
     def rich_name(self) -> str:
         """Parse save file to generate a descriptive name for save.
@@ -75,55 +494,42 @@ class SaveFile(ABC):
         Returns:
             rich name.
         """
-        with tempfile.TemporaryDirectory() as tmp_dir_str:
-            with self.unpack(Path(tmp_dir_str)) as sql_conn:
-                query = (
-                    "SELECT * FROM Player AS p JOIN Teams AS t ON p.TeamID = t.TeamID"
-                )
-                row = pd.read_sql_query(query, sql_conn).iloc[0]
-                save_type = (
-                    "test"
-                    if row["FirstName"] == "[TEAMPRINCIPAL_TEAM]"
-                    else str("career_" + row["FirstName"] + "_" + row["LastName"])
-                )
-                team = row["TeamName"]
-                seed = str(row["UniqueSeed"])
-                row = pd.read_sql_query("SELECT * FROM Player_State", sql_conn).iloc[0]
-                day = (
-                    pendulum.date(1900, 1, 1).add(days=int(row["Day"])).to_date_string()
-                )
-                try:
-                    query = (
-                        "SELECT * FROM "
-                        "Save_Weekend AS w JOIN Races AS r ON w.RaceID = r.RaceID "
-                        "JOIN Races_Tracks AS t ON r.TrackID = t.TrackID"
-                    )
-                    row = pd.read_sql_query(query, sql_conn).iloc[0]
-                    track = row["Name"]
-                    session = str(row["WeekendStage"])
-                    elements = [save_type, team, day, track, session, seed]
-                except IndexError:
-                    elements = [save_type, team, day, "track", "session", seed]
-        return "__".join(elements).replace(" ", "_")
-
-    def extract_tables(self) -> tp.Dict[str, pd.DataFrame]:
+        return format_rich_name(self.rich_fields)
+
+    def open_tables(
+        self,
+        max_tables: int | None = TABLE_STORE_MAX_TABLES,
+        compact: bool = COMPACT_TABLES,
+    ) -> TableStore:
+        """Open the unpacked save file to read its tables on demand.
+
+        Call close on the store once done with it.
+
+        Args:
+            max_tables: number of tables kept in memory, None to keep them all.
+            compact: read tables with compact dtypes, reversed when written back.
+
+        Returns:
+            lazy store of the tables.
+        """
+        return TableStore(self.unpack(), max_tables, compact)
+
+    def extract_tables(
+        self, compact: bool = COMPACT_TABLES
+    ) -> tp.Dict[str, pd.DataFrame]:
         """Extract list of table names from save file.
 
+        Args:
+            compact: read tables with compact dtypes, reversed when written back.
+
         Returns:
             list of tables.
         """
-        with tempfile.TemporaryDirectory() as tmp_dir_str:
-            with self.unpack(Path(tmp_dir_str)) as sql_conn:
-                df_tables = pd.read_sql_query(
-                    'SELECT name from sqlite_master where type= "table";', sql_conn
-                )
-                table_names: tp.List[str] = sorted(df_tables["name"])
-                table_names.remove("sqlite_sequence")
-                tables: tp.Dict[str, pd.DataFrame] = {}
-                for table_name in table_names:
-                    df = pd.read_sql_query(f"SELECT * FROM {table_name}", sql_conn)
-                    tables[table_name] = df
-        return tables
+        table_store = self.open_tables(max_tables=None, compact=compact)
+        try:
+            return {x: table_store.read_table(x) for x in table_store}
+        finally:
+            table_store.close()
 
     @classmethod
     def list_save_files(cls) -> tp.List[tp.Self]:
@@ -150,12 +556,56 @@ class OriginalSaveFile(SaveFile):
             + self.path.stem
         )
 
+    @classmethod
+    def list_save_files(cls) -> tp.List[tp.Self]:
+        """Instanciate a SaveFile for each save file seen by the folder watcher."""
+        save_files = []
+        for path in save_games_watcher().snapshot():
+            try:
+                save_files.append(cls(path))
+            except FileNotFoundError:
+                # Deleted, not reported by the watcher yet
+                continue
+        return save_files
+
 
 class CompanionSaveFile(SaveFile):
-    """Save files found in the Companion folder."""
+    """Save files found in the Companion folder.
+
+    Stored as manifests of deduplicated blobs, see save_store, path is the manifest.
+    Save files imported as a whole are still listed.
+    """
 
     saves_path = PATH_COMPANION_SAVES
 
     def __init__(self, path: Path) -> None:
         super().__init__(path)
-        self.name = self.path.stem
+        self.name = path.stem
+
+    @property
+    def is_manifest(self) -> bool:
+        return self.path.suffix == MANIFEST_SUFFIX
+
+    @contextmanager
+    def readable_path(self) -> tp.Generator[Path, None, None]:
+        """Yield the save file rebuilt from the manifest, kept while in context."""
+        if not self.is_manifest:
+            yield self.path
+            return
+        with use_build(self.path) as build_path:
+            yield build_path
+
+    @property
+    def identity(self) -> str:
+        """Hash of the manifest, the same whichever build of it is read."""
+        if self.is_manifest:
+            return manifest_id(self.path.read_bytes())
+        return super().identity
+
+    @classmethod
+    def list_save_files(cls) -> tp.List[tp.Self]:
+        """Instanciate a SaveFile for each manifest, or save file not stored yet."""
+        manifests = list(cls.saves_path.glob(f"*{MANIFEST_SUFFIX}"))
+        stems = {x.stem for x in manifests}
+        save_paths = [x for x in cls.saves_path.glob("*.sav") if x.stem not in stems]
+        return [cls(x) for x in manifests + save_paths]
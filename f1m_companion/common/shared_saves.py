@@ -0,0 +1,128 @@
+"""Saves opened in the editor, shared read-only by all sessions.
+
+Opening a save and translating its tables is done once per process, sessions only
+keep a handle on the shared save and their own edits. Shared saves are reference
+counted, and unused ones are closed, least recently used first, when they take more
+than SHARED_SAVES_MAX_BYTES of memory.
+
+Saves are opened outside the lock of the shared saves, sessions opening the same save
+wait for the first one, the others are not blocked.
+"""
+import threading
+import typing as tp
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from common.constants import SHARED_SAVES_MAX_BYTES
+from common.database_translator import TranslatedDatabase
+from common.savefile import SaveFile
+from common.table_store import TableStore
+
+
+class SharedSave:
+    """Tables and translated tables of a save, never modified once read.
+
+    Args:
+        save_file: save file to open
+    """
+
+    def __init__(self, save_file: SaveFile) -> None:
+        self.key = save_file.identity
+        self.table_store = save_file.open_tables()
+        self.translated_database = TranslatedDatabase(self.table_store)
+        self.refs = 0
+
+    def memory_usage(self) -> int:
+        """Bytes used by the tables read and translated so far."""
+        return self.table_store.memory_usage() + self.translated_database.memory_usage()
+
+    def close(self):
+        self.table_store.close()
+
+
+class SaveHandle:
+    """Reference of a session to a shared save.
+
+    Released when closed, or when the session is garbage collected. The dataframes
+    are shared, do not modify them ! Keep the edits aside, ex: in an EditLog.
+    """
+
+    def __init__(self, shared: SharedSave) -> None:
+        self.key = shared.key
+        self.table_store: TableStore = shared.table_store
+        self.translated_database: TranslatedDatabase = shared.translated_database
+        self._finalizer = weakref.finalize(self, release, shared)
+
+    def close(self):
+        self._finalizer()
+
+
+_shared: tp.OrderedDict[str, SharedSave] = OrderedDict()
+# Saves being opened, by key
+_opening: tp.Dict[str, Future[SharedSave]] = {}
+_shared_lock = threading.Lock()
+
+
+def acquire(save_file: SaveFile) -> SaveHandle:
+    """Get a handle on the shared save, opening it if no session did yet.
+
+    Opening it reads the save file, sessions opening it at the same time wait for it.
+
+    Raises:
+        Exception: the save file could not be opened, by this session or another.
+    """
+    key = save_file.identity
+    while True:
+        with _shared_lock:
+            shared = _shared.get(key)
+            if shared is not None:
+                _shared.move_to_end(key)
+                shared.refs += 1
+                return SaveHandle(shared)
+            opening = _opening.get(key)
+            if opening is None:
+                opening = _opening[key] = Future()
+                break
+        # Opened by another session, then looked up again as it may be evicted since
+        opening.result()
+
+    try:
+        shared = SharedSave(save_file)
+    except BaseException as e:
+        with _shared_lock:
+            del _opening[key]
+        opening.set_exception(e)
+        raise
+    with _shared_lock:
+        del _opening[key]
+        _shared[key] = shared
+        shared.refs += 1
+        handle = SaveHandle(shared)
+    opening.set_result(shared)
+    return handle
+
+
+def release(shared: SharedSave):
+    """Drop a reference to a shared save, and evict unused saves if needed."""
+    with _shared_lock:
+        shared.refs -= 1
+    evict()
+
+
+def evict(max_bytes: int = SHARED_SAVES_MAX_BYTES):
+    """Close least recently used saves not in use until memory fits in max_bytes.
+
+    Saves in use are never closed, so memory can stay over max_bytes.
+    """
+    with _shared_lock:
+        sizes = {key: shared.memory_usage() for key, shared in _shared.items()}
+        total = sum(sizes.values())
+        for key, shared in list(_shared.items()):
+            if total <= max_bytes:
+                break
+            if shared.refs > 0:
+                continue
+            del _shared[key]
+            shared.close()
+            total -= sizes[key]
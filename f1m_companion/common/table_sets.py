@@ -0,0 +1,93 @@
+"""Table sets, folders of tables to apply to save files.
+
+Tables are stored as Feather files, keeping their dtypes. They are memory-mapped when
+read, so pyarrow reads them without an intermediate buffer, but converting them to
+pandas copies their columns once, the editors need numpy backed tables.
+CSV files are still read, and written to share table sets with the community.
+Tables read are cached on the path, size and mtime of their file, shared by all
+sessions, do not modify them !
+"""
+import functools
+import typing as tp
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from common.constants import PATH_COMPANION_TABLES
+
+FORMAT_FEATHER = "feather"
+FORMAT_CSV = "csv"
+TABLE_FORMATS = [FORMAT_FEATHER, FORMAT_CSV]
+
+
+def list_table_sets() -> tp.List[str]:
+    return sorted(x.name for x in PATH_COMPANION_TABLES.iterdir() if x.is_dir())
+
+
+def list_tables(table_set: str) -> tp.Dict[str, Path]:
+    """Files of the tables in a table set, the last written when in several formats.
+
+    Returns:
+        path of the file of each table.
+    """
+    tables: tp.Dict[str, Path] = {}
+    for table_format in TABLE_FORMATS:
+        for path in (PATH_COMPANION_TABLES / table_set).glob(f"*.{table_format}"):
+            other = tables.get(path.stem)
+            if other is None or path.stat().st_mtime_ns > other.stat().st_mtime_ns:
+                tables[path.stem] = path
+    return dict(sorted(tables.items()))
+
+
+@functools.lru_cache(maxsize=64)
+def _read_table(path: Path, size: int, mtime_ns: int) -> pd.DataFrame:
+    """Read table file, memoized on its size and mtime."""
+    if path.suffix == f".{FORMAT_FEATHER}":
+        # One block per column, consolidating them would copy the table again
+        return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True)
+    return pd.read_csv(path)
+
+
+def read_table(path: Path) -> pd.DataFrame:
+    """Read a table file, only parsed again when the file changes."""
+    stat = path.stat()
+    return _read_table(path, stat.st_size, stat.st_mtime_ns)
+
+
+def write_table(
+    table: pd.DataFrame,
+    table_set: str,
+    table_name: str,
+    table_format: str = FORMAT_FEATHER,
+) -> Path:
+    """Write a table to a table set.
+
+    Feather files are uncompressed so they can be memory-mapped, not decoded.
+
+    Returns:
+        path of the table file.
+    """
+    folder_path = PATH_COMPANION_TABLES / table_set
+    folder_path.mkdir(exist_ok=True)
+    path = folder_path / f"{table_name}.{table_format}"
+    if table_format == FORMAT_FEATHER:
+        feather.write_feather(
+            table.reset_index(drop=True), path, compression="uncompressed"
+        )
+    else:
+        table.to_csv(path, index=False)
+    return path
+
+
+def convert_table_set(table_set: str, table_format: str) -> tp.List[Path]:
+    """Convert all tables of a table set, ex: to csv before sharing it.
+
+    Returns:
+        paths of the converted table files.
+    """
+    return [
+        write_table(read_table(path), table_set, table_name, table_format)
+        for table_name, path in list_tables(table_set).items()
+        if path.suffix != f".{table_format}"
+    ]
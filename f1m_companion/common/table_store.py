@@ -0,0 +1,151 @@
+"""Lazy access to the tables of an unpacked save file."""
+import sqlite3
+import threading
+import typing as tp
+from collections import OrderedDict
+from contextlib import ExitStack
+
+import pandas as pd
+
+from common.compact_dtypes import compact_dtypes, memory_usage
+from common.constants import COMPACT_TABLES
+
+# Tables kept in memory per store, least recently used ones are read again if needed
+TABLE_STORE_MAX_TABLES = 16
+
+
+def primary_key(sql_conn: sqlite3.Connection, table_name: str) -> tp.List[str]:
+    """Primary key columns of a table, in key order."""
+    columns = sql_conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+    return [x[1] for x in sorted(columns, key=lambda x: x[5]) if x[5] > 0]
+
+
+def column_affinities(
+    sql_conn: sqlite3.Connection, table_name: str
+) -> tp.Dict[str, str]:
+    """Affinity of each column, from its declared type in the table definition.
+
+    See https://www.sqlite.org/datatype3.html#determination_of_column_affinity
+    """
+    affinities: tp.Dict[str, str] = {}
+    for column in sql_conn.execute(f'PRAGMA table_info("{table_name}")'):
+        declared = column[2].upper()
+        if "INT" in declared:
+            affinities[column[1]] = "INTEGER"
+        elif any(x in declared for x in ("CHAR", "CLOB", "TEXT")):
+            affinities[column[1]] = "TEXT"
+        elif "BLOB" in declared or not declared:
+            affinities[column[1]] = "BLOB"
+        elif any(x in declared for x in ("REAL", "FLOA", "DOUB")):
+            affinities[column[1]] = "REAL"
+        else:
+            affinities[column[1]] = "NUMERIC"
+    return affinities
+
+
+class TableStore(tp.Mapping[str, pd.DataFrame]):
+    """Tables of an unpacked save file, only read when first accessed.
+
+    The database stays open until close is called, table names come from the schema
+    and a bounded number of tables are kept in memory. Safe to share between threads.
+
+    Args:
+        unpacked: context manager yielding the sqlite connection, ex: SaveFile.unpack
+        max_tables: number of tables kept in memory. Defaults to
+            TABLE_STORE_MAX_TABLES, None to keep them all.
+        compact: read tables with compact dtypes, see compact_dtypes. Defaults to
+            COMPACT_TABLES.
+    """
+
+    def __init__(
+        self,
+        unpacked: tp.ContextManager[sqlite3.Connection],
+        max_tables: int | None = TABLE_STORE_MAX_TABLES,
+        compact: bool = COMPACT_TABLES,
+    ) -> None:
+        self._stack = ExitStack()
+        self.sql_conn = self._stack.enter_context(unpacked)
+        self.max_tables = max_tables
+        self.compact = compact
+        query = (
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )
+        self.table_names = sorted(x for (x,) in self.sql_conn.execute(query))
+        self._tables: tp.OrderedDict[str, pd.DataFrame] = OrderedDict()
+        self._row_counts: tp.Dict[str, int] = {}
+        # Bytes used by each table read, as read from sqlite then compacted
+        self._memory: tp.Dict[str, tp.Tuple[int, int]] = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, table_name: str) -> pd.DataFrame:
+        with self._lock:
+            if table_name in self._tables:
+                self._tables.move_to_end(table_name)
+                return self._tables[table_name]
+            if table_name not in self.table_names:
+                raise KeyError(table_name)
+            df = self.read_table(table_name)
+            self._tables[table_name] = df
+            if self.max_tables is not None and len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+            return df
+
+    def __iter__(self) -> tp.Iterator[str]:
+        return iter(self.table_names)
+
+    def __len__(self) -> int:
+        return len(self.table_names)
+
+    def read_table(self, table_name: str) -> pd.DataFrame:
+        """Read a table from the database, bypassing the cache."""
+        with self._lock:
+            df = pd.read_sql_query(f'SELECT * FROM "{table_name}"', self.sql_conn)
+            if not self.compact:
+                return df
+            affinities = column_affinities(self.sql_conn, table_name)
+        compact = compact_dtypes(df, affinities)
+        self._memory[table_name] = (memory_usage(df), memory_usage(compact))
+        return compact
+
+    def primary_key(self, table_name: str) -> tp.List[str]:
+        """Primary key columns of a table, empty if it has none."""
+        with self._lock:
+            return primary_key(self.sql_conn, table_name)
+
+    def columns(self, table_name: str) -> tp.List[str]:
+        """Columns of a table without loading it, in table order."""
+        with self._lock:
+            return list(column_affinities(self.sql_conn, table_name))
+
+    def row_count(self, table_name: str) -> int:
+        """Count rows of a table without loading it."""
+        with self._lock:
+            if table_name not in self._row_counts:
+                query = f'SELECT COUNT(*) FROM "{table_name}"'
+                (count,) = self.sql_conn.execute(query).fetchone()
+                self._row_counts[table_name] = count
+            return self._row_counts[table_name]
+
+    def memory_usage(self) -> int:
+        """Bytes used by the tables in memory."""
+        with self._lock:
+            tables = list(self._tables.values())
+        return sum(memory_usage(x) for x in tables)
+
+    def memory_report(self) -> pd.DataFrame:
+        """Memory used by each table read with compact dtypes, before and after.
+
+        Returns:
+            bytes and compact_bytes of the tables, indexed on their name.
+        """
+        report = pd.DataFrame.from_dict(
+            self._memory, orient="index", columns=["bytes", "compact_bytes"]
+        )
+        report["ratio"] = report["compact_bytes"] / report["bytes"]
+        return report.sort_index()
+
+    def close(self):
+        """Close the database, tables already in memory stay available."""
+        with self._lock:
+            self._stack.close()
@@ -0,0 +1,54 @@
+"""Filter, sort and page tables server side, to send only a page to the browser."""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+PAGE_SIZES = [100, 500, 1000, 5000]
+
+
+@dataclass(frozen=True)
+class TableQuery:
+    """Rows of a table to show, and in which order.
+
+    Numeric columns are filtered on equality, others on case insensitive substring.
+    """
+
+    table_name: str
+    filter_col: str | None = None
+    filter_text: str = ""
+    sort_col: str | None = None
+    ascending: bool = True
+
+
+def query_positions(df: pd.DataFrame, query: TableQuery) -> np.ndarray:
+    """Positions of the rows of df matching query, in display order."""
+    positions = np.arange(len(df))
+    if query.filter_col is not None and query.filter_text:
+        values = df[query.filter_col]
+        if is_numeric_dtype(values):
+            number = pd.to_numeric(query.filter_text, errors="coerce")
+            mask = values.to_numpy() == number
+        else:
+            mask = (
+                values.astype(str)
+                .str.contains(query.filter_text, case=False, regex=False)
+                .to_numpy()
+            )
+        positions = positions[mask]
+    if query.sort_col is not None:
+        values = df[query.sort_col].iloc[positions].reset_index(drop=True)
+        order = values.sort_values(ascending=query.ascending, kind="stable").index
+        positions = positions[order.to_numpy()]
+    return positions
+
+
+def page_count(n_rows: int, page_size: int) -> int:
+    return max(1, -(-n_rows // page_size))
+
+
+def page_positions(positions: np.ndarray, page: int, page_size: int) -> np.ndarray:
+    """Positions of the rows on a page, pages starting at 1."""
+    start = (page - 1) * page_size
+    return positions[start : start + page_size]
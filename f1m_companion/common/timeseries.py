@@ -0,0 +1,308 @@
+"""Time series of tables across the save files of a career, in a Parquet dataset.
+
+Each ingested save file writes its tables to
+PATH_COMPANION_TIMESERIES/<dataset>/<table>/day=<in-game date>/<save id>.parquet, the
+save id being the hash of its content. A ledger of the ingested saves and tables is
+kept in the _saves folder of the dataset, so only new saves, or tables not ingested
+yet, are unpacked again. Queries run on the Parquet files, without the save files.
+
+Run from f1m_companion, ex:
+    python -m common.timeseries "/path/to/saves/*.sav" --dataset season_1 \\
+        --tables Staff_DriverData Staff_BasicData
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import typing as tp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from common.batch import expand_saves
+from common.constants import PATH_COMPANION_TIMESERIES, REPACK_WORKERS
+from common.savefile import OriginalSaveFile, save_day
+from common.table_store import TableStore, column_affinities
+from common.unpack_cache import content_hash
+
+LEDGER_FOLDER = "_saves"
+DAY_COLUMN = "day"
+SAVE_ID_COLUMN = "save_id"
+# Declared types of the columns, so their type does not change between saves, ex:
+# an integer column holding NULLs read as float
+ARROW_TYPES = {
+    "INTEGER": pa.int64(),
+    "REAL": pa.float64(),
+    "NUMERIC": pa.float64(),
+    "TEXT": pa.string(),
+}
+PARTITIONING = ds.partitioning(pa.schema([(DAY_COLUMN, pa.string())]), flavor="hive")
+
+
+def list_datasets() -> tp.List[str]:
+    if not PATH_COMPANION_TIMESERIES.exists():
+        return []
+    return sorted(x.name for x in PATH_COMPANION_TIMESERIES.iterdir() if x.is_dir())
+
+
+def list_ingested(dataset: str) -> pd.DataFrame:
+    """Save files ingested in a dataset.
+
+    Returns:
+        one row per save indexed on its id: path, size, mtime_ns, day, tables.
+    """
+    ledger = [
+        json.loads(x.read_text())
+        for x in (PATH_COMPANION_TIMESERIES / dataset / LEDGER_FOLDER).glob("*.json")
+    ]
+    df = pd.DataFrame(
+        ledger,
+        columns=[SAVE_ID_COLUMN, "path", "size", "mtime_ns", DAY_COLUMN, "tables"],
+    )
+    return df.set_index(SAVE_ID_COLUMN).sort_values(DAY_COLUMN)
+
+
+def _write_atomic(path: Path, write: tp.Callable[[str], object]):
+    """Write a file through a temporary file, hidden from dataset discovery."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def to_arrow(df: pd.DataFrame, affinities: tp.Dict[str, str]) -> pa.Table:
+    """Convert a table to arrow, with the types declared in the save.
+
+    Columns holding values of another type than declared keep their inferred type.
+    """
+    arrays = []
+    for column in df.columns:
+        try:
+            arrow_type = ARROW_TYPES.get(affinities.get(column, ""))
+            arrays.append(pa.Array.from_pandas(df[column], type=arrow_type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.Array.from_pandas(df[column]))
+    return pa.Table.from_arrays(arrays, names=[str(x) for x in df.columns])
+
+
+def ingest_save(
+    save_path: Path,
+    dataset: str,
+    table_names: tp.List[str],
+    save_id: str,
+    ingested_tables: tp.List[str],
+) -> tp.Dict[str, tp.Any]:
+    """Write tables of a save file to a dataset, in a worker process.
+
+    Args:
+        save_path: save file to ingest
+        dataset: folder of the dataset in PATH_COMPANION_TIMESERIES
+        table_names: tables to write
+        save_id: hash of the save file content
+        ingested_tables: tables of the save already in the dataset
+
+    Returns:
+        summary of the save: save, day, tables written, seconds and error if any.
+    """
+    start = time.perf_counter()
+    summary: tp.Dict[str, tp.Any] = {"save": str(save_path), "day": None}
+    dataset_path = PATH_COMPANION_TIMESERIES / dataset
+    try:
+        save_file = OriginalSaveFile(save_path)
+        with save_file.unpack_in_memory() as (_, sql_conn):
+            table_store = TableStore(nullcontext(sql_conn), 0, compact=False)
+            day = save_day(sql_conn)
+            written = []
+            for table_name in table_names:
+                if table_name not in table_store:
+                    continue
+                df = table_store.read_table(table_name)
+                table = to_arrow(df, column_affinities(sql_conn, table_name))
+                table = table.append_column(
+                    SAVE_ID_COLUMN, pa.array([save_id] * len(df), pa.string())
+                )
+                _write_atomic(
+                    dataset_path
+                    / table_name
+                    / f"{DAY_COLUMN}={day}"
+                    / f"{save_id}.parquet",
+                    lambda x: pq.write_table(table, x),
+                )
+                written.append(table_name)
+
+        # Written last, a save interrupted before is ingested again
+        stat = save_path.stat()
+        ledger = {
+            SAVE_ID_COLUMN: save_id,
+            "path": str(save_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            DAY_COLUMN: day,
+            # Tables missing from the save are not looked for again
+            "tables": sorted(set(ingested_tables) | set(table_names)),
+        }
+        _write_atomic(
+            dataset_path / LEDGER_FOLDER / f"{save_id}.json",
+            lambda x: Path(x).write_text(json.dumps(ledger)),
+        )
+        summary.update({"day": day, "tables": len(written), "error": None})
+    except Exception as e:
+        summary["error"] = repr(e)
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def ingest_saves(
+    save_paths: tp.List[Path],
+    dataset: str,
+    table_names: tp.List[str],
+    workers: int = REPACK_WORKERS,
+) -> pd.DataFrame:
+    """Ingest tables of the save files not in a dataset yet, one save per process.
+
+    Save files are identified by their content, a save copied or renamed is not
+    ingested twice, an autosave overwritten is ingested again.
+
+    Args:
+        save_paths: save files to ingest
+        dataset: folder of the dataset in PATH_COMPANION_TIMESERIES
+        table_names: tables to ingest, tables added later are ingested from saves
+            already in the dataset
+        workers: number of save files processed at once
+
+    Returns:
+        summary of each save ingested, empty if all were already in the dataset.
+    """
+    ingested = list_ingested(dataset)
+    # Avoids hashing save files already ingested, unchanged since
+    known = {
+        (x.path, x.size, x.mtime_ns): save_id for save_id, x in ingested.iterrows()
+    }
+    todo: tp.Dict[str, tp.Tuple[Path, tp.List[str]]] = {}
+    for path in save_paths:
+        stat = path.stat()
+        save_id = known.get((str(path), stat.st_size, stat.st_mtime_ns))
+        if save_id is None:
+            save_id = content_hash(path)
+        ingested_tables = (
+            ingested.loc[save_id, "tables"] if save_id in ingested.index else []
+        )
+        if save_id not in todo and not set(table_names) <= set(ingested_tables):
+            todo[save_id] = (path, ingested_tables)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                ingest_save,
+                path,
+                dataset,
+                [x for x in table_names if x not in ingested_tables],
+                save_id,
+                ingested_tables,
+            )
+            for save_id, (path, ingested_tables) in todo.items()
+        ]
+        for future in as_completed(futures):
+            summary = future.result()
+            status = "failed" if summary["error"] else "done"
+            print(f"{status} {summary['save']} in {summary['seconds']}s", flush=True)
+    return pd.DataFrame(
+        [x.result() for x in futures],
+        columns=["save", "day", "tables", "error", "seconds"],
+    )
+
+
+def read_timeseries(
+    dataset: str,
+    table_name: str,
+    columns: tp.List[str] | None = None,
+    start_day: str | None = None,
+    end_day: str | None = None,
+) -> pd.DataFrame:
+    """Read a table across the saves of a dataset.
+
+    Only the files of the days queried, and the columns queried, are read.
+
+    Args:
+        dataset: folder of the dataset in PATH_COMPANION_TIMESERIES
+        table_name: table to read
+        columns: columns to read. Defaults to None, all columns.
+        start_day: first in-game date included, ex: 2023-03-17
+        end_day: last in-game date included
+
+    Returns:
+        rows of the table in each save, with the day and id of their save.
+    """
+    path = PATH_COMPANION_TIMESERIES / dataset / table_name
+    dataset_files = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    # Schemas differ when a column only holds NULLs in some saves
+    schema = pa.unify_schemas(
+        [x.physical_schema for x in dataset_files.get_fragments()]
+        + [PARTITIONING.schema]
+    )
+    dataset_files = ds.dataset(
+        path, schema=schema, format="parquet", partitioning=PARTITIONING
+    )
+
+    day = ds.field(DAY_COLUMN)
+    condition = None
+    if start_day is not None:
+        condition = day >= start_day
+    if end_day is not None:
+        condition = (
+            day <= end_day if condition is None else condition & (day <= end_day)
+        )
+    if columns is not None:
+        columns = [DAY_COLUMN, SAVE_ID_COLUMN, *columns]
+    df = dataset_files.to_table(columns=columns, filter=condition).to_pandas()
+    return df.sort_values([DAY_COLUMN, SAVE_ID_COLUMN], ignore_index=True)
+
+
+def main(saves, dataset, tables, workers):
+    save_paths = expand_saves(saves)
+    summary = ingest_saves(save_paths, dataset, tables, workers)
+    print(f"{len(save_paths) - len(summary)} saves skipped, already ingested")
+    if len(summary):
+        print(summary.to_string(index=False))
+    return int(summary["error"].notna().any())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Ingest tables of F1 Manager Save Files in a Parquet dataset."
+    )
+    parser.add_argument(
+        "saves",
+        help="Save files to ingest, paths or glob patterns.",
+        nargs="+",
+    )
+    parser.add_argument(
+        "--dataset",
+        help="Name of the folder of the dataset in the companion timeseries folder.",
+        required=True,
+    )
+    parser.add_argument(
+        "--tables",
+        help="Tables to ingest.",
+        nargs="+",
+        required=True,
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of save files processed at once.",
+        type=int,
+        default=REPACK_WORKERS,
+    )
+    args = parser.parse_args()
+    raise SystemExit(main(args.saves, args.dataset, args.tables, args.workers))
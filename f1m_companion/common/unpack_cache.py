@@ -0,0 +1,166 @@
+"""Cache of unpacked save files shared by all sessions.
+
+Each save file is unpacked once in PATH_COMPANION_CACHE, in a folder named after the
+identity of the save (path, size, mtime and content hash). Folders are locked while
+in use, and least recently used ones are evicted when the cache grows over
+UNPACK_CACHE_MAX_BYTES.
+"""
+import fcntl
+import functools
+import hashlib
+import os
+import shutil
+import typing as tp
+from contextlib import contextmanager
+from pathlib import Path
+
+from common.constants import PATH_COMPANION_CACHE, UNPACK_CACHE_MAX_BYTES
+from common.xaranaktu.unpacking import (
+    CHNUK1_NAME,
+    DB_NAMES,
+    MAIN_DB_NAME,
+    ProgressCallback,
+    process_unpack,
+)
+
+# Written once an entry is fully unpacked, its mtime tracks the last access
+COMPLETE_MARKER = "complete"
+# ioctl to share the extents of a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+@functools.lru_cache(maxsize=256)
+def _content_hash(path: Path, size: int, mtime_ns: int) -> str:
+    """Hash save file content, memoized on its size and mtime."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+def content_hash(path: Path) -> str:
+    """Hash save file content, only read again when the file changes."""
+    stat = path.stat()
+    return _content_hash(path, stat.st_size, stat.st_mtime_ns)
+
+
+def cache_key(path: Path) -> str:
+    """Identify a save file by its path, size, mtime and content."""
+    path = path.resolve()
+    stat = path.stat()
+    content_hash = _content_hash(path, stat.st_size, stat.st_mtime_ns)
+    identity = f"{path}|{stat.st_size}|{stat.st_mtime_ns}|{content_hash}"
+    return hashlib.blake2b(identity.encode(), digest_size=16).hexdigest()
+
+
+def _entry_size(entry: Path) -> int:
+    return sum(x.stat().st_size for x in entry.iterdir())
+
+
+@contextmanager
+def cached_unpack(
+    save_path: Path, progress: ProgressCallback | None = None, key: str | None = None
+) -> tp.Generator[Path, None, None]:
+    """Yield the folder where save file is unpacked, unpacking it if needed.
+
+    Only chunk1 and main.db are unpacked, backups stay in the save file.
+
+    The folder is shared between sessions, do not write to it ! Use clone_unpacked
+    to get an editable copy.
+
+    Args:
+        save_path: save file to unpack
+        progress: called with (decompressed bytes, total bytes) if unpacked
+        key: identity of the save file. Defaults to None, its cache_key.
+
+    Yields:
+        folder with chunk1 and databases.
+    """
+    PATH_COMPANION_CACHE.mkdir(parents=True, exist_ok=True)
+    entry = PATH_COMPANION_CACHE / (key or cache_key(save_path))
+    marker = entry / COMPLETE_MARKER
+    unpacked = False
+    # Entries are only deleted under an exclusive lock, so holding a shared lock on
+    # a complete entry guarantees it stays there while in use
+    lock_fd = os.open(entry.with_suffix(".lock"), os.O_RDWR | os.O_CREAT)
+    try:
+        while True:
+            fcntl.flock(lock_fd, fcntl.LOCK_SH)
+            if marker.exists():
+                break
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            if not marker.exists():
+                shutil.rmtree(entry, ignore_errors=True)
+                entry.mkdir()
+                process_unpack(
+                    save_path, entry, progress=progress, databases={MAIN_DB_NAME}
+                )
+                marker.touch()
+                unpacked = True
+        marker.touch()
+        if unpacked:
+            evict()
+        yield entry
+    finally:
+        os.close(lock_fd)
+
+
+def evict(max_bytes: int = UNPACK_CACHE_MAX_BYTES):
+    """Delete least recently used entries until cache fits in max_bytes.
+
+    Entries in use, including by this process, are skipped.
+    """
+    entries: tp.List[tp.Tuple[float, int, Path]] = []
+    for marker in PATH_COMPANION_CACHE.glob(f"*/{COMPLETE_MARKER}"):
+        try:
+            entries.append(
+                (marker.stat().st_mtime, _entry_size(marker.parent), marker.parent)
+            )
+        except FileNotFoundError:
+            # Evicted by another session meanwhile
+            continue
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        lock_fd = os.open(entry.with_suffix(".lock"), os.O_RDWR | os.O_CREAT)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            continue
+        try:
+            if (entry / COMPLETE_MARKER).exists():
+                (entry / COMPLETE_MARKER).unlink()
+                shutil.rmtree(entry)
+                total -= size
+        finally:
+            os.close(lock_fd)
+
+
+def clone_file(src: Path, dst: Path):
+    """Copy src to dst, sharing the data blocks when the filesystem allows it."""
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            shutil.copyfileobj(f_src, f_dst, 1024 * 1024)
+
+
+def clone_unpacked(
+    save_path: Path,
+    target_dir: Path,
+    progress: ProgressCallback | None = None,
+    key: str | None = None,
+):
+    """Copy-on-write clone of the unpacked save file into target_dir.
+
+    Args:
+        save_path: save file to unpack
+        target_dir: editable folder to clone chunk1 and databases to
+        progress: called with (decompressed bytes, total bytes) if unpacked
+        key: identity of the save file. Defaults to None, its cache_key.
+    """
+    with cached_unpack(save_path, progress, key) as entry:
+        for name in (CHNUK1_NAME, *DB_NAMES):
+            if (entry / name).exists():
+                clone_file(entry / name, target_dir / name)
@@ -0,0 +1,177 @@
+"""Watch the SaveGames folder for new or changed save files.
+
+The folder is listed once, then kept up to date from inotify events, or by polling it
+when inotify is not available, ex: on network or Docker mounts. A save file is only
+reported once the game finished writing it: no event for WATCH_DEBOUNCE_SECONDS and
+the same size and mtime on two checks in a row.
+"""
+import os
+import threading
+import time
+import traceback
+import typing as tp
+from pathlib import Path
+
+from watchdog.events import FileSystemEvent, PatternMatchingEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.api import BaseObserver
+from watchdog.observers.polling import PollingObserver
+
+from common.constants import PATH_SAVES, WATCH_DEBOUNCE_SECONDS, WATCH_POLLING
+
+FileStat = tp.Tuple[int, int]
+
+
+def _stat(path: Path) -> FileStat | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class SaveWatcher(PatternMatchingEventHandler):
+    """Save files of a folder, updated in the background.
+
+    Args:
+        folder: folder to watch, not recursively
+        debounce: seconds without writes before a save file is reported
+        polling: poll the folder instead of using inotify
+    """
+
+    def __init__(
+        self,
+        folder: Path,
+        debounce: float = WATCH_DEBOUNCE_SECONDS,
+        polling: bool = WATCH_POLLING,
+    ) -> None:
+        super().__init__(
+            patterns=["*.sav"], ignore_directories=True, case_sensitive=False
+        )
+        self.folder = folder
+        self.debounce = debounce
+        self.polling = polling
+        self.version = 0
+        self._saves: tp.Dict[Path, FileStat] = {}
+        # Last event of the files being written, and their stat at the last check
+        self._dirty: tp.Dict[Path, float] = {}
+        self._checked: tp.Dict[Path, FileStat | None] = {}
+        self._callbacks: tp.List[tp.Callable[[Path], None]] = []
+        self._changed = threading.Condition()
+        self._stopped = threading.Event()
+        self._observer: BaseObserver | None = None
+
+    def start(self):
+        """List the folder, then watch it and settle changes in background threads."""
+        with self._changed:
+            for path in self.folder.glob("*.sav"):
+                stat = _stat(path)
+                if stat is not None:
+                    self._saves[path] = stat
+        self._observer = None
+        if not self.polling:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(self, str(self.folder), recursive=False)
+                self._observer.start()
+            except OSError:
+                # Ex: inotify watches limit reached, unsupported filesystem
+                self._observer = None
+        if self._observer is None:
+            self._observer = PollingObserver(timeout=max(self.debounce / 2, 0.5))
+            self._observer.schedule(self, str(self.folder), recursive=False)
+            self._observer.start()
+        threading.Thread(
+            target=self._settle_loop, name="save_watcher", daemon=True
+        ).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def on_any_event(self, event: FileSystemEvent):
+        now = time.monotonic()
+        with self._changed:
+            for raw_path in (event.src_path, getattr(event, "dest_path", "")):
+                # Paths are bytes when the folder was given as bytes
+                path = os.fsdecode(raw_path)
+                if path and path.lower().endswith(".sav"):
+                    self._dirty[Path(path)] = now
+
+    def _settle_loop(self):
+        while not self._stopped.wait(min(self.debounce / 4, 0.5)):
+            self._settle()
+
+    def _settle(self):
+        """Report the save files that stopped changing."""
+        now = time.monotonic()
+        changed: tp.List[Path] = []
+        with self._changed:
+            version = self.version
+            due = [x for x, t in self._dirty.items() if now - t >= self.debounce]
+            for path in due:
+                stat = _stat(path)
+                if stat is not None and self._checked.get(path) != stat:
+                    # Still being written, or first check
+                    self._checked[path] = stat
+                    self._dirty[path] = now
+                    continue
+                del self._dirty[path]
+                self._checked.pop(path, None)
+                if stat == self._saves.get(path):
+                    continue
+                if stat is None:
+                    del self._saves[path]
+                else:
+                    self._saves[path] = stat
+                    changed.append(path)
+                self.version += 1
+            if self.version != version:
+                self._changed.notify_all()
+            callbacks = list(self._callbacks)
+        for path in changed:
+            for callback in callbacks:
+                try:
+                    callback(path)
+                except Exception:
+                    traceback.print_exc()
+
+    def subscribe(self, callback: tp.Callable[[Path], None]):
+        """Call callback with the path of each new or changed save file."""
+        with self._changed:
+            if callback not in self._callbacks:
+                self._callbacks.append(callback)
+
+    def snapshot(self) -> tp.Dict[Path, FileStat]:
+        """Save files of the folder, without listing it.
+
+        Returns:
+            size and mtime_ns of each save file.
+        """
+        with self._changed:
+            return dict(self._saves)
+
+    def wait(self, version: int, timeout: float) -> int:
+        """Wait for save files to change after version, or timeout.
+
+        Returns:
+            current version.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+_save_games_watcher: SaveWatcher | None = None
+_save_games_watcher_lock = threading.Lock()
+
+
+def save_games_watcher() -> SaveWatcher:
+    """Watcher of the SaveGames folder shared by all sessions, started once."""
+    global _save_games_watcher
+    with _save_games_watcher_lock:
+        if _save_games_watcher is None:
+            _save_games_watcher = SaveWatcher(PATH_SAVES)
+            _save_games_watcher.start()
+        return _save_games_watcher
@@ -1,21 +1,63 @@
 # Shamelessly stolen from https://github.com/xAranaktu/F1-Manager-2022-SaveFile-Repacker
 
 import argparse
+import collections
+import itertools
 import mmap
 import os
 import pathlib as pl
 import struct
+import typing as tp
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 CHNUK1_NAME = "chunk1"
 MAIN_DB_NAME = "main.db"
 BACKUP_DB_NAME = "backup1.db"
 BACKUP_DB2_NAME = "backup2.db"
+DB_NAMES = (MAIN_DB_NAME, BACKUP_DB_NAME, BACKUP_DB2_NAME)
+BACKUP_DB_NAMES = (BACKUP_DB_NAME, BACKUP_DB2_NAME)
+
+# None None just before the packed DB Section.
+NONE_NONE_SIG = (
+    b"\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00"
+)
+# Compressed size, then the size of each database
+DB_HEADER = struct.Struct("iiii")
+
+# Size of the buffers read from / written to disk, bounds the memory usage
+CHUNK_SIZE = 1024 * 1024
+# Parallel compression: size of the blocks deflated independently, and size of the
+# previous block's tail used to prime the next one (the deflate window)
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024
+
+STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman_only": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+    "fixed": zlib.Z_FIXED,
+}
+
+# Called with (bytes done, bytes total)
+ProgressCallback = tp.Callable[[int, int], None]
+
+
+def phase_progress(
+    progress: ProgressCallback | None, phase: int, nb_phases: int
+) -> ProgressCallback | None:
+    """Report a phase of a longer task as its share of a single progress.
+
+    ex: unpack then pack, the unpack goes from 0 to 50%, the pack from 50 to 100%.
+    """
+    if progress is None:
+        return None
 
+    def phase_callback(done: int, total: int):
+        progress(phase * total + done, nb_phases * total)
 
-def create_db(fname, decompressed_db, _start, _end):
-    with open(fname, "wb") as f:
-        f.write(decompressed_db[_start:_end])
+    return phase_callback
 
 
 def get_db_mmap(path):
@@ -26,96 +68,477 @@ def get_db_mmap(path):
         return mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
 
 
-def pack_databases(_dir):
-    """_summary_
-
-    Args:
-        _dir: _description_
+class PackedDatabase:
+    """Database left compressed in a save file, only inflated when iterated.
 
-    Returns:
-        _description_
+    Use packed_databases to create them. Databases of the same save file share a
+    single pass over the zlib stream, so they must be iterated in order, once.
     """
-    result = list()
 
-    mmaps = [
-        get_db_mmap(os.path.join(_dir, MAIN_DB_NAME)),
-        get_db_mmap(os.path.join(_dir, BACKUP_DB_NAME)),
-        get_db_mmap(os.path.join(_dir, BACKUP_DB2_NAME)),
-    ]
+    def __init__(self, stream: "_PackedStream", index: int, size: int) -> None:
+        self.stream = stream
+        self.index = index
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def iter_chunks(self) -> tp.Iterator[memoryview]:
+        return self.stream.iter_chunks(self.index)
+
 
-    to_zlib = b""
+class _PackedStream:
+    """Inflate the DB section of a save file once, on demand, for PackedDatabase."""
 
-    db_sizes = list()
-    for mmap_obj in mmaps:
-        if not mmap_obj:
-            continue
-        _sz = len(mmap_obj)
-        db_sizes.append(_sz)
-        to_zlib += mmap_obj.read()
+    def __init__(self, from_file, db_section_off: int, db_sizes: tp.List[int]):
+        self.from_file = from_file
+        self.offset = db_section_off + DB_HEADER.size
+        self.db_sizes = db_sizes
+        self._databases: tp.Iterator[tp.Tuple[int, memoryview]] | None = None
+        self._pending: tp.Tuple[int, memoryview] | None = None
 
-    compressed = zlib.compress(to_zlib)
-    result.append(struct.pack("I", len(compressed)))
+    def _iter_databases(self) -> tp.Iterator[tp.Tuple[int, memoryview]]:
+        with open(self.from_file, "rb") as f:
+            f.seek(self.offset)
+            yield from iter_databases(f, self.db_sizes)
 
-    for db_size in db_sizes:
-        result.append(struct.pack("I", db_size))
-    result.append(compressed)
-    return result
+    def iter_chunks(self, index: int) -> tp.Iterator[memoryview]:
+        if self._databases is None:
+            self._databases = self._iter_databases()
+        while True:
+            item = self._pending or next(self._databases, None)
+            self._pending = None
+            if item is None:
+                return
+            if item[0] > index:
+                self._pending = item
+                return
+            if item[0] == index:
+                yield item[1]
 
 
-def do_pack(from_folder, to_file):
+def packed_databases(
+    from_file, names: tp.Collection[str] = DB_NAMES
+) -> tp.Dict[str, PackedDatabase]:
+    """Reference databases of a save file without inflating them yet.
+
+    The zlib stream holds all databases back to back, so compressed data can't be
+    copied as is to another save: databases are inflated again, lazily, when packed.
+
+    Args:
+        from_file: save file holding the databases
+        names: databases to reference, missing ones are ignored
+
+    Returns:
+        databases by name, in save file order.
+    """
+    with open(from_file, "rb") as f:
+        with mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ) as mm:
+            db_section_off, db_sizes = read_header(mm)
+    db_sizes = select_databases(db_sizes, names)
+    stream = _PackedStream(from_file, db_section_off, db_sizes)
+    return {
+        DB_NAMES[index]: PackedDatabase(stream, index, size)
+        for index, size in enumerate(db_sizes)
+        if DB_NAMES[index] in names
+    }
+
+
+def iter_chunks(db, chunk_size: int = CHUNK_SIZE) -> tp.Iterator[tp.Any]:
+    """Iterate over a database buffer or a PackedDatabase by chunks."""
+    if isinstance(db, PackedDatabase):
+        yield from db.iter_chunks()
+        return
+    for pos in range(0, len(db), chunk_size):
+        yield db[pos : pos + chunk_size]
+
+
+def iter_blocks(dbs: tp.Sequence[tp.Any], block_size: int) -> tp.Iterator[bytes]:
+    """Yield the concatenated databases in block_size slices."""
+    pending = bytearray()
+    for db in dbs:
+        for data in iter_chunks(db, block_size):
+            pending += data
+            while len(pending) >= block_size:
+                yield bytes(pending[:block_size])
+                del pending[:block_size]
+    if pending:
+        yield bytes(pending)
+
+
+def zlib_header(level: int) -> bytes:
+    """Build the 2 bytes zlib header for a 32K window deflate stream."""
+    if level == zlib.Z_DEFAULT_COMPRESSION:
+        level = 6
+    cmf = 0x78
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    flg = flevel << 6
+    flg += 31 - (cmf * 256 + flg) % 31
+    return bytes((cmf, flg))
+
+
+def deflate_block(
+    block: bytes, zdict: bytes, level: int, strategy: int, last: bool
+) -> bytes:
+    """Deflate a block to raw deflate data, ending on a byte boundary.
+
+    Priming with the previous block's tail keeps back-references across blocks,
+    so the ratio stays close to a single stream.
+    """
+    kwargs = {"zdict": zdict} if zdict else {}
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, strategy, **kwargs
+    )
+    flush_mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    return compressor.compress(block) + compressor.flush(flush_mode)
+
+
+def compress_serial(
+    out: tp.BinaryIO,
+    dbs: tp.Sequence[tp.Any],
+    level: int,
+    strategy: int,
+    progress: ProgressCallback | None = None,
+):
+    """Compress the databases to out as a single zlib stream, on one core."""
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, strategy
+    )
+    total = sum(len(db) for db in dbs)
+    done = 0
+    for db in dbs:
+        for data in iter_chunks(db):
+            out.write(compressor.compress(data))
+            done += len(data)
+            if progress is not None:
+                progress(done, total)
+    out.write(compressor.flush())
+
+
+def compress_parallel(
+    out: tp.BinaryIO,
+    dbs: tp.Sequence[tp.Any],
+    level: int,
+    strategy: int,
+    workers: int,
+    block_size: int = BLOCK_SIZE,
+    progress: ProgressCallback | None = None,
+):
+    """Compress the databases to out as a single zlib stream, pigz style.
+
+    Blocks are deflated in a thread pool (zlib releases the GIL), each primed with
+    the tail of the previous block and sync flushed, so that their concatenation
+    is one valid deflate stream. Only a few blocks per worker are kept in memory.
+    """
+    total = sum(len(db) for db in dbs)
+    done = 0
+    checksum = zlib.adler32(b"")
+    out.write(zlib_header(level))
+
+    in_flight: tp.Deque = collections.deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        blocks = iter_blocks(dbs, block_size)
+        block = next(blocks, b"")
+        zdict = b""
+        while True:
+            next_block = next(blocks, None)
+            last = next_block is None
+            future = executor.submit(deflate_block, block, zdict, level, strategy, last)
+            in_flight.append((future, len(block)))
+            checksum = zlib.adler32(block, checksum)
+            zdict = block[-DICT_SIZE:]
+            while in_flight and (last or len(in_flight) >= 2 * workers):
+                future, size = in_flight.popleft()
+                out.write(future.result())
+                done += size
+                if progress is not None:
+                    progress(done, total)
+            if next_block is None:
+                break
+            block = next_block
+
+    out.write(struct.pack(">I", checksum))
+
+
+def pack_databases(
+    out: tp.BinaryIO,
+    dbs: tp.Sequence[tp.Any],
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+    strategy: int = zlib.Z_DEFAULT_STRATEGY,
+    workers: int = 1,
+    progress: ProgressCallback | None = None,
+) -> int:
+    """Write the DB section header and the compressed databases to out.
+
+    The databases are streamed through a single zlib stream, the compressed size
+    is only known at the end so it is patched in the header once done.
+
+    Args:
+        out: seekable file, positioned right after chunk1
+        dbs: buffers (mmap, bytes) or PackedDatabase of the databases to pack
+        level: zlib compression level, 1 is fastest, 9 is smallest
+        strategy: zlib compression strategy
+        workers: number of threads compressing in parallel, 1 to stay on one core
+        progress: called with (uncompressed bytes packed, total bytes)
+
+    Returns:
+        size of the compressed section.
+    """
+    header_off = out.tell()
+    # Missing databases are written as empty, the header always has the same size
+    db_sizes = [len(db) for db in dbs] + [0] * (len(DB_NAMES) - len(dbs))
+    out.write(DB_HEADER.pack(0, *db_sizes))
+    data_off = out.tell()
+
+    if workers > 1:
+        compress_parallel(out, dbs, level, strategy, workers, progress=progress)
+    else:
+        compress_serial(out, dbs, level, strategy, progress)
+
+    data_end = out.tell()
+    out.seek(header_off)
+    out.write(struct.pack("i", data_end - data_off))
+    out.seek(data_end)
+    return data_end - data_off
+
+
+def do_pack(
+    from_folder,
+    to_file,
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+    strategy: int = zlib.Z_DEFAULT_STRATEGY,
+    workers: int = 1,
+    progress: ProgressCallback | None = None,
+    original_file=None,
+):
+    """Pack chunk1 and the databases of a folder to a save file.
+
+    Databases missing from the folder are carried over from original_file if given,
+    ex: backups that were not unpacked.
+    """
     chunk1_path = os.path.join(from_folder, CHNUK1_NAME)
     if not os.path.exists(chunk1_path):
         print(f"Can't find {chunk1_path}")
         return
 
-    new_file_content = b""
     with open(chunk1_path, "rb") as f:
-        new_file_content += f.read()
+        chunk1 = f.read()
+    mmaps = [get_db_mmap(os.path.join(from_folder, name)) for name in DB_NAMES]
+    originals = {}
+    if original_file is not None:
+        missing = [name for name, x in zip(DB_NAMES, mmaps) if not x]
+        originals = packed_databases(original_file, missing)
+    dbs = [x or originals.get(name) for name, x in zip(DB_NAMES, mmaps)]
+    try:
+        pack_to_file(
+            chunk1, [x for x in dbs if x], to_file, level, strategy, workers, progress
+        )
+    finally:
+        for mmap_obj in mmaps:
+            if mmap_obj:
+                mmap_obj.close()
+
+
+def pack_to_file(
+    chunk1: bytes,
+    dbs: tp.Sequence[tp.Any],
+    to_file,
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+    strategy: int = zlib.Z_DEFAULT_STRATEGY,
+    workers: int = 1,
+    progress: ProgressCallback | None = None,
+):
+    """Write a save file from chunk1 and database buffers, ex: from serialize().
+
+    The save file is written next to to_file then moved, so databases can be
+    carried over from the file being overwritten.
+    """
+    tmp_file = f"{to_file}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(chunk1)
+            pack_databases(f, dbs, level, strategy, workers, progress)
+        os.replace(tmp_file, to_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
 
-    for _bytes in pack_databases(from_folder):
-        new_file_content += _bytes
 
-    with open(to_file, "wb") as f:
-        f.write(new_file_content)
+def read_header(mm) -> tp.Tuple[int, tp.List[int]]:
+    """Locate the packed DB section of a save file.
 
+    Args:
+        mm: mmap of the save file
 
-def do_unpack(from_file, to_folder):
-    with open(from_file, "rb") as f:
-        mm = mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ)
+    Returns:
+        offset of the DB section header, and sizes of the packed databases.
+    """
+    db_section_off = mm.find(NONE_NONE_SIG) + len(NONE_NONE_SIG)
+    db_section_off += 4  # Unk 4 Bytes
 
-    # None None just before the packed DB Section.
-    none_none_sig = (
-        b"\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00\x05\x00\x00\x00\x4E\x6F\x6E\x65\x00"
-    )
+    _, *db_sizes = DB_HEADER.unpack_from(mm, db_section_off)
+    # Backup databases may be missing in fresh careers
+    db_sizes = list(itertools.takewhile(lambda x: x > 0, db_sizes))
+    return db_section_off, db_sizes
 
-    db_section_off = mm.find(none_none_sig) + len(none_none_sig)
-    db_section_off += 4  # Unk 4 Bytes
 
-    # Part of the file that we ignore as it's not database
-    # But we need it later to "pack" new save
-    with open(os.path.join(to_folder, CHNUK1_NAME), "wb") as f:
-        f.write(mm.read(db_section_off))
+def iter_decompressed(
+    f: tp.BinaryIO, chunk_size: int = CHUNK_SIZE
+) -> tp.Iterator[bytes]:
+    """Inflate the zlib stream starting at the current position of f.
 
-    struct.unpack("i", mm.read(4))[0]
+    Never holds more than chunk_size compressed or decompressed bytes at once.
+
+    Raises:
+        zlib.error: the file ends before the zlib stream.
+    """
+    decompressor = zlib.decompressobj()
+    while not decompressor.eof:
+        data = decompressor.unconsumed_tail or f.read(chunk_size)
+        if not data:
+            raise zlib.error("Truncated zlib stream, the save file is incomplete")
+        yield decompressor.decompress(data, chunk_size)
 
-    databases = {
-        os.path.join(to_folder, MAIN_DB_NAME): struct.unpack("i", mm.read(4))[0],
-        os.path.join(to_folder, BACKUP_DB_NAME): struct.unpack("i", mm.read(4))[0],
-        os.path.join(to_folder, BACKUP_DB2_NAME): struct.unpack("i", mm.read(4))[0],
-    }
 
-    decompressed_dbs = zlib.decompress(mm.read())
+def iter_databases(
+    f: tp.BinaryIO, db_sizes: tp.List[int], chunk_size: int = CHUNK_SIZE
+) -> tp.Iterator[tp.Tuple[int, memoryview]]:
+    """Split the inflated DB section into (database index, chunk) pairs.
+
+    Stops consuming the zlib stream once all db_sizes bytes have been produced.
+
+    Raises:
+        zlib.error: the zlib stream is truncated.
+        ValueError: the zlib stream holds less than db_sizes bytes.
+    """
+    index = 0
+    remaining = db_sizes[0] if db_sizes else 0
+    for data in iter_decompressed(f, chunk_size):
+        view = memoryview(data)
+        while view:
+            while remaining == 0:
+                index += 1
+                if index >= len(db_sizes):
+                    return
+                remaining = db_sizes[index]
+            part = view[:remaining]
+            yield index, part
+            remaining -= len(part)
+            view = view[len(part) :]
+    if remaining or index < len(db_sizes) - 1:
+        raise ValueError(
+            f"The DB section holds less than the {sum(db_sizes)} bytes of its header"
+        )
+
+
+def select_databases(
+    db_sizes: tp.List[int], databases: tp.Collection[str]
+) -> tp.List[int]:
+    """Sizes of the databases to inflate to reach all the selected ones."""
+    selected = [i for i, _ in enumerate(db_sizes) if DB_NAMES[i] in databases]
+    last = max(selected, default=-1)
+    return db_sizes[: last + 1]
+
+
+def do_unpack(
+    from_file,
+    to_folder,
+    chunk_size: int = CHUNK_SIZE,
+    progress: ProgressCallback | None = None,
+    databases: tp.Collection[str] = DB_NAMES,
+):
+    """Unpack chunk1 and the databases of a save file to a folder.
+
+    Streams the zlib section to disk, so memory usage stays around chunk_size
+    whatever the size of the save file.
 
-    _start = 0
-    for dump_name, db_size in databases.items():
-        # print(f'{dump_name}:{db_size}')
-        if db_size == 0:
-            break
-        create_db(dump_name, decompressed_dbs, _start, _start + db_size)
-        _start += db_size
+    Args:
+        from_file: save file to unpack
+        to_folder: folder to write chunk1 and databases to
+        chunk_size: size of the buffers read and inflated at once
+        progress: called with (decompressed bytes, total bytes)
+        databases: databases to write, the zlib stream is consumed only up to the
+            last of them. Defaults to all.
+    """
+    with open(from_file, "rb") as f:
+        with mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ) as mm:
+            db_section_off, db_sizes = read_header(mm)
+            # Part of the file that we ignore as it's not database
+            # But we need it later to "pack" new save
+            with open(os.path.join(to_folder, CHNUK1_NAME), "wb") as chunk1:
+                chunk1.write(mm[:db_section_off])
+
+        db_sizes = select_databases(db_sizes, databases)
+        f.seek(db_section_off + DB_HEADER.size)
+        total = sum(db_sizes)
+        done = 0
+        current_index = None
+        db_file: tp.BinaryIO | None = None
+        try:
+            for index, data in iter_databases(f, db_sizes, chunk_size):
+                done += len(data)
+                if progress is not None:
+                    progress(done, total)
+                if DB_NAMES[index] not in databases:
+                    continue
+                if db_file is None or index != current_index:
+                    if db_file is not None:
+                        db_file.close()
+                    db_file = open(os.path.join(to_folder, DB_NAMES[index]), "wb")
+                    current_index = index
+                db_file.write(data)
+        finally:
+            if db_file is not None:
+                db_file.close()
+
+
+def unpack_to_memory(
+    from_file,
+    chunk_size: int = CHUNK_SIZE,
+    progress: ProgressCallback | None = None,
+    databases: tp.Collection[str] = DB_NAMES,
+) -> tp.Tuple[bytes, tp.Dict[str, bytearray]]:
+    """Unpack chunk1 and the databases of a save file without touching the disk.
 
+    Args:
+        from_file: save file to unpack
+        chunk_size: size of the buffers read and inflated at once
+        progress: called with (decompressed bytes, total bytes)
+        databases: databases to unpack, the zlib stream is consumed only up to the
+            last of them. Defaults to all.
 
-def process_unpack(input_file: pl.Path, result_dir: pl.Path):
+    Returns:
+        chunk1, and the content of each database by name, ex: for deserialize().
+    """
+    with open(from_file, "rb") as f:
+        with mmap.mmap(f.fileno(), length=0, access=mmap.ACCESS_READ) as mm:
+            db_section_off, db_sizes = read_header(mm)
+            chunk1 = mm[:db_section_off]
+
+        db_sizes = select_databases(db_sizes, databases)
+        f.seek(db_section_off + DB_HEADER.size)
+        dbs = {
+            DB_NAMES[i]: bytearray()
+            for i, _ in enumerate(db_sizes)
+            if DB_NAMES[i] in databases
+        }
+        total = sum(db_sizes)
+        done = 0
+        for index, data in iter_databases(f, db_sizes, chunk_size):
+            if DB_NAMES[index] in dbs:
+                dbs[DB_NAMES[index]] += data
+            done += len(data)
+            if progress is not None:
+                progress(done, total)
+    return chunk1, dbs
+
+
+def process_unpack(
+    input_file: pl.Path,
+    result_dir: pl.Path,
+    progress: ProgressCallback | None = None,
+    databases: tp.Collection[str] = DB_NAMES,
+):
     if not os.path.exists(input_file):
         print(f"Can't find {input_file}")
         return
@@ -123,19 +546,27 @@ def process_unpack(input_file: pl.Path, result_dir: pl.Path):
     if not os.path.exists(result_dir):
         os.makedirs(result_dir)
 
-    do_unpack(input_file, result_dir)
+    do_unpack(input_file, result_dir, progress=progress, databases=databases)
 
 
-def process_repack(input_dir, result_file):
-    do_pack(input_dir, result_file)
+def process_repack(
+    input_dir,
+    result_file,
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+    strategy: int = zlib.Z_DEFAULT_STRATEGY,
+    workers: int = 1,
+    progress: ProgressCallback | None = None,
+    original_file=None,
+):
+    do_pack(input_dir, result_file, level, strategy, workers, progress, original_file)
 
 
-def main(operation, input_path, res_path):
+def main(operation, input_path, res_path, level, strategy, workers):
     # python script.py --operation unpack --input autosave.sav --result result
     if operation == "unpack":
         process_unpack(input_path, res_path)
     elif operation == "repack":
-        process_repack(input_path, res_path)
+        process_repack(input_path, res_path, level, STRATEGIES[strategy], workers)
 
 
 if __name__ == "__main__":
@@ -158,5 +589,31 @@ if __name__ == "__main__":
         "file for repack)",
         required=True,
     )
+    parser.add_argument(
+        "--level",
+        help="zlib compression level for repack, 1 is fastest, 9 is smallest.",
+        type=int,
+        choices=range(-1, 10),
+        default=zlib.Z_DEFAULT_COMPRESSION,
+    )
+    parser.add_argument(
+        "--strategy",
+        help="zlib compression strategy for repack.",
+        choices=list(STRATEGIES),
+        default="default",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of threads compressing in parallel for repack.",
+        type=int,
+        default=1,
+    )
     args = parser.parse_args()
-    main(args.operation, args.input, args.result)
+    main(
+        args.operation,
+        args.input,
+        args.result,
+        args.level,
+        args.strategy,
+        args.workers,
+    )
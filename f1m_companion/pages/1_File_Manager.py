@@ -1,12 +1,14 @@
 """Page for the File Manager."""
 
-from shutil import copyfile
-
+import pandas as pd
 import streamlit as st
-from common.components import selectbox_with_default
-from common.constants import FAKE_PATH_F1M, PATH_COMPANION_SAVES, PATH_SAVES
+from common import auto_import, catalog, jobs
+from common.components import jobs_status, rerun_on_new_saves, selectbox_with_default
+from common.constants import PATH_COMPANION_SAVES
 from common.initialize import init_page
-from common.savefile import OriginalSaveFile
+from common.save_store import MANIFEST_SUFFIX, store_save_file
+from common.savefile import OriginalSaveFile, format_rich_name
+from common.watcher import save_games_watcher
 
 init_page()
 
@@ -22,20 +24,71 @@ if st.session_state.display_help:
             1. Select the save file your want to import
             2. Click on the import save file button
             3. Save file imported ! Companion also renamed the file with a more explicit name
+
+            New save files are listed as soon as the game writes them. Turn on live
+            updates to see them without refreshing the page, and automatic import to
+            import them without clicking.
             """
         )
 
+col_live, col_auto = st.columns(2)
+live_updates = col_live.checkbox("Live updates", key="live_updates")
+auto_import.set_enabled(
+    col_auto.checkbox(
+        "Import new save files automatically",
+        value=auto_import.is_enabled(),
+        help="Shared by all users of the Companion.",
+    )
+)
+
+# Save files are listed by the folder watcher, not by listing the folder on each run
+watcher_version = save_games_watcher().version
 save_files = OriginalSaveFile.dict_save_files()
 st.info(f"Listed {len(save_files)} save files in SaveGames folder.")
-selected_save_name = selectbox_with_default("Pick save file to import", save_files)
-selected_save = save_files[selected_save_name]
-
-new_save_path = PATH_COMPANION_SAVES / f"{selected_save.rich_name}.sav"
-if new_save_path.exists():
-    st.warning(f"Save file {new_save_path.stem} already exists, want to overwrite ?")
-if st.button("Import Save File"):
-    new_save_path = PATH_COMPANION_SAVES / f"{selected_save.rich_name}.sav"
-    copyfile(selected_save.path, new_save_path)
-    st.success(
-        f"Copied save file to {FAKE_PATH_F1M / new_save_path.relative_to(PATH_SAVES)}"
-    )
+
+# Rich fields are extracted in the background, the page only reads the catalog
+nb_pending = catalog.refresh(save_files.values())
+df_catalog = catalog.load(save_files.values())
+if nb_pending:
+    st.info(f"Reading {nb_pending} new save files in the background...")
+    st.button("Refresh")
+st.dataframe(
+    df_catalog.drop(columns=["rich_name", "error"]).sort_values("day", ascending=False),
+    use_container_width=True,
+)
+
+# Without stopping the page, the import jobs status and live updates are below
+selected_save_name = selectbox_with_default(
+    "Pick save file to import", save_files, stop=False
+)
+rich_name = None
+if selected_save_name is not None:
+    selected_save = save_files[selected_save_name]
+    rich_name = df_catalog.loc[selected_save_name, "rich_name"]
+    if pd.isna(rich_name):
+        # Not indexed yet, index it now, in memory like the background task
+        rich_fields = catalog.index_save_file(selected_save)
+        rich_name = format_rich_name(rich_fields) if rich_fields else None
+        if rich_name is None:
+            st.error(f"Could not read {selected_save_name}, see the catalog error")
+
+if rich_name is not None:
+    # Companion save files are stored deduplicated, as a manifest of their blobs
+    new_save_path = (PATH_COMPANION_SAVES / rich_name).with_suffix(MANIFEST_SUFFIX)
+    if new_save_path.exists() or new_save_path.with_suffix(".sav").exists():
+        st.warning(
+            f"Save file {new_save_path.stem} already exists, want to overwrite ?"
+        )
+    if st.button("Import Save File"):
+        jobs.submit(
+            "import",
+            f"Import {selected_save_name} as {new_save_path.stem}",
+            store_save_file,
+            selected_save.path,
+            new_save_path,
+        )
+
+jobs_status("import")
+
+if live_updates:
+    rerun_on_new_saves(watcher_version, nb_pending)
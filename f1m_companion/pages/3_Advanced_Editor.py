@@ -1,12 +1,21 @@
 """Page for the Advanced Editor."""
-import typing as tp
-
-import pandas as pd
 import streamlit as st
-from common.components import selectbox_with_default
+from common import jobs, shared_saves
+from common.compact_dtypes import expand_dtypes
+from common.components import jobs_status, selectbox_with_default
 from common.database_translator import TranslatedDatabase
+from common.edit_log import CellEdit, EditLog, python_value, row_keys
 from common.initialize import init_page
+from common.save_diff import STATUS_IDENTICAL, SaveDiff, diff_saves
 from common.savefile import CompanionSaveFile
+from common.table_sets import TABLE_FORMATS
+from common.table_view import (
+    PAGE_SIZES,
+    TableQuery,
+    page_count,
+    page_positions,
+    query_positions,
+)
 
 init_page()
 
@@ -20,17 +29,17 @@ if st.session_state.display_help:
         st.markdown(
             """
                 1. Select the save file your want to edit
-                2. Select the table your want to edit
+                2. Select the table your want to edit, filter and sort its rows
                 3. Edit the values you want (some columns are uneditable)
                 4. Click Apply changes (:warning: If you leave this page without applying, changes will be lost)
                 5. Repack to a save file
                     1. Chose name for edited save file
                     2. Click repack
                 6. Save a single table
-                    1. Chose table to save as csv
-                    2. Chose name of folder where to save sav
+                    1. Chose table to save
+                    2. Chose name of folder where to save sav, and file format
                     3. Click save
-                    4. You can now use those csv files to edit tables in the simple editor
+                    4. You can now use those files to edit tables in the simple editor
                 7. Load your save in F1Manager !
             """
         )
@@ -40,54 +49,200 @@ st.info(f"Listed {len(save_files)} save files in companion folder.")
 selected_save_name = selectbox_with_default("Select Save File to edit", save_files)
 selected_save = save_files[selected_save_name]
 
-# Only one unpacked save in the session_state at a time
+# Only one save in the session_state at a time
 # If you navigate out the page then come back, must keep the changes, so
-# We need to store the translated tables in the session_state
+# We need to store the edits in the session_state
+# Tables are shared read-only by all sessions opening the same save, edits are kept
+# as a cell level log and applied to a private copy only when needed
 
 translated_database: TranslatedDatabase
-edited_tables: tp.Dict[str, pd.DataFrame]
+edit_log: EditLog
 key_save_name = "key_save_name"
-key_translated_database = "key_translated_database"
-key_edited_tables = "key_edited_tables"
+key_save_handle = "key_save_handle"
+key_edit_log = "key_edit_log"
+key_pending_log = "key_pending_log"
+key_query = "key_query"
+key_save_diff = "key_save_diff"
+key_editor_view = "key_editor_view"
 
 if (
-    key_translated_database not in st.session_state
+    key_save_handle not in st.session_state
     or selected_save.name != st.session_state[key_save_name]
 ):
     # When first render or selected save changes
-    # - Extract table from the save
-    # - Reset the edited_tables session_state
+    # - Release the previous save, tables are only read when accessed
+    # - Reset the edit_log session_state
+    if key_save_handle in st.session_state:
+        st.session_state[key_save_handle].close()
     st.session_state[key_save_name] = selected_save.name
-    tables = selected_save.extract_tables()
-    st.session_state[key_translated_database] = TranslatedDatabase(tables)
-    st.session_state[key_edited_tables] = {}
+    with st.spinner("Opening save file..."):
+        st.session_state[key_save_handle] = shared_saves.acquire(selected_save)
+    st.session_state[key_edit_log] = EditLog()
+    st.session_state[key_pending_log] = EditLog()
+    st.session_state[key_query] = (None,)
+    st.session_state[key_editor_view] = None
+
+save_handle = st.session_state[key_save_handle]
+translated_database = save_handle.translated_database
+table_store = save_handle.table_store
+edit_log = st.session_state[key_edit_log]
+pending_log = st.session_state[key_pending_log]
 
-translated_database = st.session_state[key_translated_database]
-edited_tables = st.session_state[key_edited_tables]
+with st.expander("Compare with an earlier save"):
+    other_save_names = sorted(x for x in save_files if x != selected_save.name)
+    other_save_name = st.selectbox(
+        "Select save to compare with",
+        [None, *other_save_names],
+        format_func=lambda x: "<select>" if x is None else x,
+    )
+    if other_save_name is not None:
+        diff_key = (other_save_name, selected_save.name)
+        if st.session_state.get(key_save_diff, (None,))[0] != diff_key:
+            with st.spinner("Comparing save files..."):
+                st.session_state[key_save_diff] = (
+                    diff_key,
+                    diff_saves(save_files[other_save_name], selected_save),
+                )
+        save_diff: SaveDiff = st.session_state[key_save_diff][1]
+        summary = save_diff.summary
+        st.caption(f"{(summary['status'] == STATUS_IDENTICAL).sum()} identical tables")
+        st.dataframe(summary[summary["status"] != STATUS_IDENTICAL], hide_index=True)
+        if save_diff.tables:
+            diff_table_name = st.selectbox(
+                "Show changes of table", sorted(save_diff.tables)
+            )
+            table_diff = save_diff.tables[diff_table_name]
+            for tab, df in zip(
+                st.tabs(["Cells changed", "Rows added", "Rows removed"]),
+                [
+                    table_diff.cells.assign(key=table_diff.cells["key"].astype(str)),
+                    table_diff.added,
+                    table_diff.removed,
+                ],
+            ):
+                # Only the first rows are sent to the browser
+                tab.caption(f"{len(df)} rows")
+                tab.dataframe(df.head(PAGE_SIZES[-1]), hide_index=True)
 
 selected_table_name = selectbox_with_default(
-    "Select Table to edit", translated_database.tables
+    "Select Table to edit", translated_database.table_names
+)
+
+selected_table = translated_database.get_table(selected_table_name)
+clean_cols = [x for x in selected_table.dataframe.columns if not x.startswith("TMP_")]
+key_cols = table_store.primary_key(selected_table_name) or clean_cols
+
+# Only a page of the table is sent to the browser, rows are filtered and sorted
+# server side on the shared translated table
+columns = list(selected_table.dataframe.columns)
+with st.expander("Filter and sort"):
+    col1, col2, col3, col4 = st.columns(4)
+    filter_col = col1.selectbox(
+        "Filter column",
+        [None, *columns],
+        format_func=lambda x: "<none>" if x is None else x,
+        key=f"filter_col_{selected_table_name}",
+    )
+    filter_text = col2.text_input(
+        "Filter value", key=f"filter_text_{selected_table_name}"
+    )
+    sort_col = col3.selectbox(
+        "Sort by",
+        [None, *columns],
+        format_func=lambda x: "<none>" if x is None else x,
+        key=f"sort_col_{selected_table_name}",
+    )
+    descending = col4.checkbox("Descending", key=f"descending_{selected_table_name}")
+query = TableQuery(
+    selected_table_name, filter_col, filter_text, sort_col, not descending
+)
+
+if st.session_state.get(key_query, (None,))[0] != query:
+    st.session_state[key_query] = (
+        query,
+        query_positions(selected_table.dataframe, query),
+    )
+positions = st.session_state[key_query][1]
+
+col1, col2 = st.columns(2)
+page_size = col1.selectbox("Rows per page", PAGE_SIZES, index=2)
+n_pages = page_count(len(positions), page_size)
+page = col2.number_input(
+    "Page", min_value=1, max_value=n_pages, value=1, key=f"page_{query}_{page_size}"
 )
+st.caption(f"{len(positions)} rows match, page {page} / {n_pages}")
+
+if table_store.compact:
+    with st.expander("Memory usage of the tables read"):
+        st.dataframe(table_store.memory_report())
 
-selected_table = translated_database.tables[selected_table_name]
-df = st.data_editor(
-    selected_table.dataframe,
+# The editor shows the page with the edits made so far, built again only when the
+# page changes or edits are applied, along with the key of each row.
+# Edits of the page left are kept as pending edits.
+window = (query, page_size, page)
+view = st.session_state[key_editor_view]
+if view is None or view["window"] != window:
+    if view is not None:
+        pending_log.merge(view["pending"])
+    # Compact dtypes would restrict the values the editor accepts
+    page_table = expand_dtypes(
+        selected_table.dataframe.iloc[page_positions(positions, page, page_size)]
+    )
+    edits = EditLog()
+    edits.merge(edit_log)
+    edits.merge(pending_log)
+    view = {
+        "window": window,
+        "version": 0 if view is None else view["version"] + 1,
+        "dataframe": edits.apply(selected_table_name, page_table),
+        "keys": row_keys(page_table, key_cols),
+        "pending": EditLog(),
+    }
+    st.session_state[key_editor_view] = view
+
+editor_key = f"editor_{view['version']}"
+st.data_editor(
+    view["dataframe"],
     disabled=selected_table.disabled_cols,
     hide_index=True,
+    key=editor_key,
 )
 
-if not df.equals(selected_table.dataframe):
-    edited_tables[selected_table_name] = df
+# The editor state holds the edits since the view was built, by row position
+view["pending"] = EditLog()
+edited_rows = st.session_state.get(editor_key, {}).get("edited_rows", {})
+for position, changes in edited_rows.items():
+    for column, new in changes.items():
+        old = view["dataframe"].iat[
+            int(position), view["dataframe"].columns.get_loc(column)
+        ]
+        view["pending"].record(
+            CellEdit(
+                selected_table_name,
+                view["keys"][int(position)],
+                column,
+                python_value(old),
+                new,
+            ),
+            key_cols,
+        )
 
-if edited_tables:
-    st.info(f"You've edited the tables {sorted(edited_tables)}")
+edited_table_names = sorted(
+    set(edit_log.table_names + pending_log.table_names + view["pending"].table_names)
+)
+if edited_table_names:
+    st.info(f"You've edited the tables {edited_table_names}")
 else:
     st.info("No changes made.")
     st.stop()
 
 if st.button("Apply changes"):
-    for table_name, table in edited_tables.items():
-        translated_database.tables[table_name].dataframe = table
+    edit_log.merge(pending_log)
+    edit_log.merge(view["pending"])
+    st.session_state[key_pending_log] = EditLog()
+    # Build the view again with the applied edits on next run
+    view["window"] = None
+    view["pending"] = EditLog()
     st.success("Applied changes ! ")
 
 col1, col2 = st.columns(2)
@@ -98,19 +253,37 @@ with col2:
         "Choose name for the repacked save", selected_save.name + "_edited"
     )
     if st.button("Repack save"):
-        new_path = selected_save.repack(
-            new_save_name, translated_database.clean_tables()
+        # Edits made while the job waits in queue are not part of it
+        edits = EditLog()
+        edits.merge(edit_log)
+        jobs.submit(
+            "repack",
+            f"Repack {selected_save.name} to {new_save_name}",
+            selected_save.repack,
+            new_save_name,
+            {},
+            st.session_state.compression_level,
+            st.session_state.compress_workers,
+            edits=edits,
         )
-        st.success(f"Saved save file to {new_path}")
 
 with col1:
-    st.subheader("Save a single table as a csv file")
+    st.subheader("Save a single table to a table set")
+    # Without stopping the page, the repack job status is below
     selected_edited_table = selectbox_with_default(
-        "Select table to save", st.session_state[key_edited_tables]
+        "Select table to save", edit_log.table_names, stop=False
     )
     tables_folder = st.text_input("Choose folder name", "my_custom_tables")
-    if st.button("Save table as csv"):
-        export_path = translated_database.table_to_csv(
-            selected_edited_table, tables_folder
+    table_format = st.radio(
+        "Choose file format, csv to share it with the community",
+        TABLE_FORMATS,
+        horizontal=True,
+    )
+    save_table = st.button("Save table", disabled=selected_edited_table is None)
+    if save_table and selected_edited_table is not None:
+        export_path = translated_database.export_table(
+            selected_edited_table, tables_folder, edit_log, table_format
         )
         st.success(f"Saved table to {export_path}")
+
+jobs_status("repack")
@@ -0,0 +1,49 @@
+import pandas as pd
+from common.edit_log import CellEdit, EditLog
+
+
+def _edit(key, column, old, new, table_name="t"):
+    return CellEdit(table_name, key, column, old, new)
+
+
+def test_record_keeps_original_value():
+    edit_log = EditLog()
+    edit_log.record(_edit((1,), "a", 1, 2), ["id"])
+    edit_log.record(_edit((1,), "a", 2, 3), ["id"])
+    assert [(x.old, x.new) for x in edit_log] == [(1, 3)]
+
+    # Edited back to its original value
+    edit_log.record(_edit((1,), "a", 3, 1), ["id"])
+    assert len(edit_log) == 0
+
+
+def test_merge():
+    edit_log, other = EditLog(), EditLog()
+    edit_log.record(_edit((1,), "a", 1, 2), ["id"])
+    other.record(_edit((1,), "a", 2, 3), ["id"])
+    other.record(_edit((2,), "a", 5, 6, "u"), ["id"])
+    edit_log.merge(other)
+    assert edit_log.table_names == ["t", "u"]
+    assert [(x.old, x.new) for x in edit_log.table_edits("t")] == [(1, 3)]
+
+
+def test_apply():
+    df = pd.DataFrame({"id": [1, 2, 3], "a": [1.0, 2.0, None]})
+    edit_log = EditLog()
+    edit_log.record(_edit((3,), "a", None, 4.0), ["id"])
+    edit_log.record(_edit((4,), "a", 1.0, 5.0), ["id"])
+    edited = edit_log.apply("t", df)
+    assert edited["a"].tolist() == [1.0, 2.0, 4.0]
+    # The original content is not modified
+    assert df["a"].isna().iloc[2]
+    # Pages without edited rows are returned as is
+    page = df.iloc[:2]
+    assert edit_log.apply("t", page) is page
+    assert edit_log.apply("u", df) is df
+
+
+def test_apply_identical_rows():
+    df = pd.DataFrame({"a": [1, 1, 2], "b": ["x", "x", "y"]})
+    edit_log = EditLog()
+    edit_log.record(_edit((1, "x"), "b", "x", "z"), ["a", "b"])
+    assert edit_log.apply("t", df)["b"].tolist() == ["z", "x", "y"]
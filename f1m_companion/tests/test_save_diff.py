@@ -0,0 +1,65 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+from common.save_diff import OTHER_SCHEMA, attach, diff_table, tables_differ
+
+
+def test_diff_table_with_key():
+    before = pd.DataFrame({"id": [1, 2, 3], "a": [1, 2, 3], "b": ["x", "y", None]})
+    after = pd.DataFrame({"id": [2, 3, 4], "a": [2, 5, 4], "b": ["y", None, "z"]})
+    diff = diff_table(before, after, ["id"])
+    assert diff.added.to_dict("list") == {"id": [4]}
+    assert diff.removed.to_dict("list") == {"id": [1]}
+    assert diff.cells.to_dict("records") == [
+        {"key": (3,), "column": "a", "old": 3, "new": 5}
+    ]
+    assert len(diff) == 3
+
+
+def test_diff_table_with_composite_key():
+    before = pd.DataFrame({"a": [1, 1], "b": [1, 2], "v": [1.0, 2.0]})
+    after = pd.DataFrame({"a": [1, 1], "b": [1, 2], "v": [1.0, 2.5]})
+    diff = diff_table(before, after, ["a", "b"])
+    assert diff.cells.to_dict("records") == [
+        {"key": (1, 2), "column": "v", "old": 2.0, "new": 2.5}
+    ]
+    assert diff.added.empty and diff.removed.empty
+
+
+def test_diff_table_key_only():
+    diff = diff_table(pd.DataFrame({"a": [1, 2]}), pd.DataFrame({"a": [1, 3]}), ["a"])
+    assert diff.added.to_dict("list") == {"a": [3]}
+    assert diff.removed.to_dict("list") == {"a": [2]}
+    assert diff.cells.empty
+
+
+def test_diff_table_without_key():
+    before = pd.DataFrame({"a": [1, 1, 2], "b": ["x", "x", "y"]})
+    after = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"]})
+    diff = diff_table(before, after, [])
+    assert diff.added.to_dict("list") == {"a": [3], "b": ["z"]}
+    # One of the two copies removed
+    assert diff.removed.to_dict("list") == {"a": [1], "b": ["x"]}
+    assert diff.cells.empty
+
+
+def test_diff_table_identical():
+    df = pd.DataFrame({"id": [1, 2], "a": [1.0, None]})
+    assert len(diff_table(df, df.copy(), ["id"])) == 0
+    assert len(diff_table(df, df.copy(), [])) == 0
+
+
+@pytest.mark.parametrize("without_rowid", [False, True])
+def test_tables_differ(without_rowid):
+    conns = [sqlite3.connect(":memory:") for _ in range(2)]
+    suffix = " WITHOUT ROWID" if without_rowid else ""
+    for conn in conns:
+        conn.execute(f"CREATE TABLE t (a INTEGER PRIMARY KEY, b TEXT){suffix}")
+        conn.executemany("INSERT INTO t VALUES (?, ?)", [(1, "x"), (2, None)])
+    attach(conns[0], conns[1], OTHER_SCHEMA)
+    assert tables_differ(conns[0], "t", ["a", "b"], OTHER_SCHEMA) is False
+    conns[0].execute("UPDATE other.t SET b = 'y' WHERE a = 2")
+    assert tables_differ(conns[0], "t", ["a", "b"], OTHER_SCHEMA) is True
+    conns[0].execute("DELETE FROM other.t WHERE a = 2")
+    assert tables_differ(conns[0], "t", ["a", "b"], OTHER_SCHEMA) is True
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from benchmarks.synthetic import SaveSize, make_chunk1, make_database, write_save_file
+from common import save_store, savefile, unpack_cache
+from common.save_store import (
+    collect_garbage,
+    delete_save_file,
+    evict_builds,
+    store_save_file,
+    use_build,
+)
+from common.savefile import CompanionSaveFile, OriginalSaveFile
+from common.xaranaktu.unpacking import DB_NAMES, unpack_to_memory
+
+SIZE = SaveSize(staff=50, results=200)
+
+
+@pytest.fixture
+def companion(tmp_path, monkeypatch):
+    """Redirect the companion folders to tmp_path."""
+    saves = tmp_path / "saves"
+    saves.mkdir()
+    monkeypatch.setattr(save_store, "PATH_COMPANION_SAVES", saves)
+    monkeypatch.setattr(save_store, "PATH_COMPANION_BLOBS", tmp_path / "blobs")
+    monkeypatch.setattr(save_store, "PATH_COMPANION_BUILDS", tmp_path / "builds")
+    monkeypatch.setattr(unpack_cache, "PATH_COMPANION_CACHE", tmp_path / "cache")
+    return tmp_path
+
+
+def _save_file(path, seed=0):
+    main_db = make_database(SIZE, seed)
+    backup = make_database(SIZE, 100)
+    write_save_file(path, make_chunk1(seed), [main_db, backup, backup])
+    return path
+
+
+def _store(companion, name, seed=0):
+    src = _save_file(companion / f"{name}.sav", seed)
+    return store_save_file(src, companion / "saves" / f"{name}.json")
+
+
+def _blobs(companion):
+    return {x.name for x in (companion / "blobs").glob("*/*")}
+
+
+def _referenced(manifest_path):
+    manifest = json.loads(manifest_path.read_bytes())
+    return {manifest["chunk1"], *sum(manifest["databases"].values(), [])}
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_read_manifest_without_build(companion, monkeypatch, in_memory):
+    monkeypatch.setattr(savefile, "UNPACK_IN_MEMORY", in_memory)
+    manifest_path = _store(companion, "a")
+    save_file = CompanionSaveFile(manifest_path)
+    original = OriginalSaveFile(companion / "a.sav")
+    assert save_file.rich_name == original.rich_name
+    tables = save_file.extract_tables()
+    assert tables.keys() == original.extract_tables().keys()
+
+    new_path = save_file.repack_to(companion / "repacked.sav", {})
+    assert unpack_to_memory(new_path) == unpack_to_memory(companion / "a.sav")
+
+
+def test_build_round_trip(companion):
+    manifest_path = _store(companion, "a")
+    with use_build(manifest_path) as build_path:
+        assert unpack_to_memory(build_path) == unpack_to_memory(companion / "a.sav")
+        # Nested uses share the build
+        with use_build(manifest_path) as nested_path:
+            assert nested_path == build_path
+
+
+def test_evict_builds_keeps_builds_in_use(companion):
+    manifest_paths = [_store(companion, x, seed) for seed, x in enumerate("abc")]
+    with use_build(manifest_paths[0]) as build_path:
+        for manifest_path in manifest_paths[1:]:
+            with use_build(manifest_path):
+                pass
+        evict_builds(max_builds=0)
+        assert list((companion / "builds").glob("*.sav")) == [build_path]
+    evict_builds(max_builds=0)
+    assert not list((companion / "builds").iterdir())
+
+    # Evicted builds are built again when read
+    save_file = CompanionSaveFile(manifest_paths[0])
+    save_file.repack_to(companion / "repacked.sav", {})
+    assert len(unpack_to_memory(companion / "repacked.sav")[1]) == len(DB_NAMES)
+
+
+def test_collect_garbage(companion):
+    a = _store(companion, "a", 0)
+    b = _store(companion, "b", 1)
+    # Backups are shared by both saves
+    assert _referenced(a) & _referenced(b)
+    assert _blobs(companion) == _referenced(a) | _referenced(b)
+    assert collect_garbage() == 0
+
+    delete_save_file(a)
+    assert _blobs(companion) == _referenced(b)
+    with use_build(b) as build_path:
+        assert unpack_to_memory(build_path) == unpack_to_memory(companion / "b.sav")
+
+    # Replacing a manifest collects the blobs of the previous version
+    store_save_file(_save_file(companion / "c.sav", 2), b)
+    assert _blobs(companion) == _referenced(b)
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+from common.edit_log import CellEdit, EditLog, row_keys
+from common.savefile import write_cell_edits, write_table_diff
+
+
+@pytest.fixture
+def sql_conn():
+    sql_conn = sqlite3.connect(":memory:")
+    sql_conn.executescript(
+        """
+        CREATE TABLE keyed (id INTEGER, sub INTEGER, val REAL, name TEXT,
+            PRIMARY KEY (id, sub));
+        INSERT INTO keyed VALUES (1, 1, 1.5, 'a'), (1, 2, NULL, 'b'), (2, 1, 3.0, NULL);
+        CREATE TABLE unkeyed (a INTEGER, b TEXT);
+        INSERT INTO unkeyed VALUES (1, 'x'), (1, 'x'), (2, 'y');
+        """
+    )
+    yield sql_conn
+    sql_conn.close()
+
+
+def _read(sql_conn, table_name):
+    return pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY rowid", sql_conn)
+
+
+def test_write_cell_edits(sql_conn):
+    edit_log = EditLog()
+    key_cols = ["id", "sub"]
+    edit_log.record(CellEdit("keyed", (1, 2), "val", None, 2.5), key_cols)
+    edit_log.record(CellEdit("keyed", (1, 2), "name", "b", "c"), key_cols)
+    edit_log.record(CellEdit("keyed", (2, 1), "name", None, "d"), key_cols)
+    assert write_cell_edits(sql_conn, edit_log) == 2
+    df = _read(sql_conn, "keyed")
+    assert df["val"].tolist() == [1.5, 2.5, 3.0]
+    assert df["name"].tolist() == ["a", "c", "d"]
+
+
+def test_write_cell_edits_identical_rows(sql_conn):
+    """The database and EditLog.apply edit the same copy of identical rows."""
+    original = _read(sql_conn, "unkeyed")
+    key_cols = ["a", "b"]
+    edit_log = EditLog()
+    key = row_keys(original, key_cols)[1]
+    edit_log.record(CellEdit("unkeyed", key, "b", "x", "z"), key_cols)
+    assert write_cell_edits(sql_conn, edit_log) == 1
+    df = _read(sql_conn, "unkeyed")
+    assert df["b"].tolist() == ["z", "x", "y"]
+    assert edit_log.apply("unkeyed", original).equals(df)
+
+
+def test_write_table_diff(sql_conn):
+    table = _read(sql_conn, "keyed")
+    assert write_table_diff(sql_conn, "keyed", table) == 0
+
+    # Update (1, 1), delete (1, 2), insert (3, 1)
+    table = pd.DataFrame(
+        {"id": [1, 2, 3], "sub": [1, 1, 1], "val": [9.0, 3.0, 4.0], "name": "a"}
+    )
+    table.loc[1, "name"] = None
+    assert write_table_diff(sql_conn, "keyed", table) == 3
+    df = _read(sql_conn, "keyed").sort_values(["id", "sub"], ignore_index=True)
+    pd.testing.assert_frame_equal(df, table)
+
+
+def test_write_table_diff_coerces_types(sql_conn):
+    # As read from a csv file, ids with NULLs read as float, names of digits as int
+    table = pd.DataFrame(
+        {"id": [1.0, 1.0, 2.0], "sub": [1, 2, 1], "val": [1.5, None, 3.0]}
+    ).assign(name=[1, 2, None])
+    assert write_table_diff(sql_conn, "keyed", table) == 2
+    rows = sql_conn.execute("SELECT id, name, typeof(name) FROM keyed").fetchall()
+    assert rows == [(1, "1", "text"), (1, "2", "text"), (2, None, "null")]
+
+
+def test_write_table_diff_without_key(sql_conn):
+    table = _read(sql_conn, "unkeyed")
+    assert write_table_diff(sql_conn, "unkeyed", table) == 0
+    table.loc[2, "b"] = "z"
+    # Rewritten entirely
+    assert write_table_diff(sql_conn, "unkeyed", table) == 6
+    pd.testing.assert_frame_equal(_read(sql_conn, "unkeyed"), table)
@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+
+import pytest
+from common import shared_saves
+
+
+class FakeSaveFile:
+    def __init__(self, identity, error=None):
+        self.identity = identity
+        self.opened = threading.Event()
+        self.error = error
+        self.opens = 0
+
+
+class FakeSharedSave:
+    """Opened once save_file.opened is set."""
+
+    def __init__(self, save_file):
+        save_file.opens += 1
+        assert save_file.opened.wait(5)
+        if save_file.error is not None:
+            raise save_file.error
+        self.key = save_file.identity
+        self.table_store = self.translated_database = None
+        self.refs = 0
+
+    def memory_usage(self):
+        return 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_saves(monkeypatch):
+    monkeypatch.setattr(shared_saves, "SharedSave", FakeSharedSave)
+    monkeypatch.setattr(shared_saves, "_shared", OrderedDict())
+    monkeypatch.setattr(shared_saves, "_opening", {})
+
+
+def _start_threads(target, nb_threads):
+    threads = [threading.Thread(target=target, daemon=True) for _ in range(nb_threads)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def _join(threads):
+    for thread in threads:
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+def test_acquire_does_not_block_other_saves():
+    slow = FakeSaveFile("slow")
+    handles = []
+    threads = _start_threads(lambda: handles.append(shared_saves.acquire(slow)), 2)
+
+    # Opened and evicted while the slow save is being opened
+    fast = FakeSaveFile("fast")
+    fast.opened.set()
+    shared_saves.acquire(fast).close()
+    shared_saves.evict(max_bytes=0)
+    assert list(shared_saves._shared) == []
+
+    slow.opened.set()
+    _join(threads)
+    assert slow.opens == 1
+    assert len(handles) == 2
+    assert shared_saves._shared["slow"].refs == 2
+
+
+def test_acquire_error():
+    broken = FakeSaveFile("broken", error=ValueError("corrupt"))
+    errors = []
+
+    def acquire():
+        try:
+            shared_saves.acquire(broken)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = _start_threads(acquire, 2)
+    broken.opened.set()
+    _join(threads)
+    assert len(errors) == 2
+    assert not shared_saves._opening and not shared_saves._shared
+
+    # Opened again on the next acquire
+    broken.error = None
+    shared_saves.acquire(broken).close()
+    assert list(shared_saves._shared) == ["broken"]
@@ -0,0 +1,124 @@
+import io
+import random
+import zlib
+
+import pytest
+from benchmarks.synthetic import make_chunk1, write_save_file
+from common.xaranaktu.unpacking import (
+    DB_HEADER,
+    DB_NAMES,
+    DICT_SIZE,
+    compress_parallel,
+    do_pack,
+    do_unpack,
+    unpack_to_memory,
+)
+
+BLOCK_SIZE = 4 * DICT_SIZE
+
+
+def _database(size: int, seed: int = 0) -> bytes:
+    """Compressible bytes, repeated runs of random words like sqlite pages."""
+    rng = random.Random(seed)
+    words = [rng.randbytes(rng.randrange(1, 16)) for _ in range(256)]
+    data = bytearray()
+    while len(data) < size:
+        data += rng.choice(words) * rng.randrange(1, 8)
+    return bytes(data[:size])
+
+
+CASES = {
+    "empty": [],
+    "empty_databases": [b"", b""],
+    "smaller_than_block": [_database(1000)],
+    "one_block": [_database(BLOCK_SIZE)],
+    "several_blocks": [_database(3 * BLOCK_SIZE + 123)],
+    "several_databases": [_database(BLOCK_SIZE // 2 + 7, 1), _database(BLOCK_SIZE, 2)]
+    * 3,
+}
+
+
+@pytest.mark.parametrize("level", range(-1, 10))
+@pytest.mark.parametrize("case", CASES)
+@pytest.mark.parametrize("workers", [1, 4])
+def test_compress_parallel_round_trip(case, level, workers):
+    dbs = CASES[case]
+    out = io.BytesIO()
+    compress_parallel(
+        out, dbs, level, zlib.Z_DEFAULT_STRATEGY, workers, block_size=BLOCK_SIZE
+    )
+    # decompress also checks the adler32 of the stream
+    assert zlib.decompress(out.getvalue()) == b"".join(dbs)
+
+
+@pytest.mark.parametrize("level", range(-1, 10))
+def test_compress_parallel_header_matches_zlib(level):
+    out = io.BytesIO()
+    compress_parallel(out, [b"abc"], level, zlib.Z_DEFAULT_STRATEGY, 2)
+    assert out.getvalue()[:2] == zlib.compress(b"abc", level)[:2]
+
+
+def test_compress_parallel_progress():
+    dbs = CASES["several_databases"]
+    calls = []
+    compress_parallel(
+        io.BytesIO(),
+        dbs,
+        6,
+        zlib.Z_DEFAULT_STRATEGY,
+        2,
+        block_size=BLOCK_SIZE,
+        progress=lambda done, total: calls.append((done, total)),
+    )
+    total = sum(len(x) for x in dbs)
+    assert [x for x, _ in calls] == sorted(x for x, _ in calls)
+    assert calls[-1] == (total, total)
+
+
+def _save_file(path, dbs, sizes=None):
+    write_save_file(path, make_chunk1(), dbs)
+    if sizes is not None:
+        # Header claiming other sizes than the databases written
+        data = bytearray(path.read_bytes())
+        offset = len(make_chunk1())
+        packed_size = DB_HEADER.unpack_from(data, offset)[0]
+        sizes = [*sizes, *[0] * (len(DB_NAMES) - len(sizes))]
+        DB_HEADER.pack_into(data, offset, packed_size, *sizes)
+        path.write_bytes(bytes(data))
+    return path
+
+
+def test_unpack_round_trip(tmp_path):
+    dbs = [_database(100_000, 1), _database(50_000, 2)]
+    save_path = _save_file(tmp_path / "save.sav", dbs)
+    do_unpack(save_path, tmp_path)
+    assert [(tmp_path / x).read_bytes() for x in DB_NAMES[:2]] == dbs
+    assert list(unpack_to_memory(save_path)[1].values()) == dbs
+
+
+def test_unpack_truncated_save(tmp_path):
+    save_path = _save_file(
+        tmp_path / "save.sav", [_database(100_000, i) for i in range(3)]
+    )
+    save_path.write_bytes(save_path.read_bytes()[:-5000])
+    folder = tmp_path / "unpacked"
+    folder.mkdir()
+    # main.db is before the truncated part, the backups are carried over on repack
+    do_unpack(save_path, folder, databases=["main.db"])
+    with pytest.raises(zlib.error):
+        do_pack(folder, tmp_path / "repacked.sav", original_file=save_path)
+    assert not (tmp_path / "repacked.sav").exists()
+    with pytest.raises(zlib.error):
+        do_unpack(save_path, folder)
+    with pytest.raises(zlib.error):
+        unpack_to_memory(save_path)
+
+
+def test_unpack_header_larger_than_stream(tmp_path):
+    dbs = [_database(100_000, 1), _database(50_000, 2)]
+    save_path = _save_file(tmp_path / "save.sav", dbs, sizes=[100_000, 60_000])
+    with pytest.raises(ValueError):
+        do_unpack(save_path, tmp_path)
+    save_path = _save_file(tmp_path / "save.sav", dbs, sizes=[100_000, 50_000, 10])
+    with pytest.raises(ValueError):
+        unpack_to_memory(save_path)